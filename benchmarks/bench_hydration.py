@@ -0,0 +1,55 @@
+"""
+compares hydrating query results through MongoModel.__init__ (the old path)
+with MongoModel._from_document, which Query uses now.
+
+this only measures the python side, documents are built in memory so no
+mongodb server is needed.
+
+    $ PYTHONPATH=. python benchmarks/bench_hydration.py
+"""
+import time
+from bson.objectid import ObjectId as ObjectId_
+
+from mongomodels import MongoModel, Column, String, Integer, Boolean, Date
+
+N = 100000
+
+
+class Item(MongoModel):
+    name = Column(String)
+    description = Column(String)
+    price = Column(Integer)
+    stock = Column(Integer)
+    active = Column(Boolean)
+    created_at = Column(Date)
+    category = Column(String)
+    vendor = Column(String)
+
+
+def make_documents(n):
+    return [{'_id': ObjectId_(), 'name': 'item %s' % i, 'description': 'description %s' % i,
+             'price': i, 'stock': i % 10, 'active': bool(i % 2), 'created_at': None,
+             'category': 'category', 'vendor': 'vendor'} for i in xrange(n)]
+
+
+def hydrate_with_init(docs):
+    for doc in docs:
+        Item(**doc)
+
+
+def hydrate_with_from_document(docs):
+    for doc in docs:
+        Item._from_document(doc)
+
+
+def bench(name, fn):
+    docs = make_documents(N)
+    start = time.time()
+    fn(docs)
+    elapsed = time.time() - start
+    print '%-30s %10.0f docs/sec' % (name, N / elapsed)
+
+
+if __name__ == '__main__':
+    bench('MongoModel.__init__', hydrate_with_init)
+    bench('MongoModel._from_document', hydrate_with_from_document)
@@ -1,6 +1,8 @@
 from .column import MongoModel, String, Integer, \
     Column, or_, and_, ValidationError, Boolean, ObjectId, \
-    Date
+    Date, ConfigurationError, configure_models, eager, bindparam, sync_indexes
 from .relationships import belongs_to, has_and_belongs_to
 from .base import connections
+from .aggregation import func
+from .session import Session
 
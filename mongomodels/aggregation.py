@@ -0,0 +1,189 @@
+"""
+aggregations built from queries, see Query.group_by and Query.agg
+
+    >>> from mongomodels import func
+    >>> rows = User.query.filter(User.age > 10).group_by(User.role).agg(
+    ...     count=func.count(), avg_age=func.avg(User.age)).sort('count', -1).limit(10)
+    >>> for row in rows:
+    ...     print row['role'], row['count'], row['avg_age']
+
+the grouping runs on the server, only the result rows come back.
+"""
+from bson.son import SON
+
+from . import events
+
+
+def field_name(column):
+    """the document key of a Column, or the string itself"""
+    return getattr(column, 'name', column)
+
+
+def get_sort(sort_):
+    """converts the arguments given to Query.sort to a list of (key, direction)"""
+    if not sort_:
+        return None
+    if isinstance(sort_[0], (list, tuple)):
+        return [(field_name(k), d) for k, d in sort_[0]]
+    return [(field_name(sort_[0]), sort_[1] if len(sort_) > 1 else 1)]
+
+
+class Aggregate(object):
+    """an accumulator of a $group stage, created with func"""
+
+    def __init__(self, op, column=None):
+        self.op = op
+        self.column = column
+
+    def as_mongo_expression(self):
+        if self.column is None:
+            return {self.op: 1}
+        if isinstance(self.column, (int, long, float)):
+            return {self.op: self.column}
+        return {self.op: '$%s' % field_name(self.column)}
+
+    def __repr__(self):
+        return '<Aggregate %s>' % self.as_mongo_expression()
+
+
+class func(object):
+    """
+    accumulators for Query.agg()
+
+        >>> User.query.group_by(User.role).agg(count=func.count(), oldest=func.max(User.age))
+    """
+
+    @staticmethod
+    def count():
+        return Aggregate('$sum')
+
+    @staticmethod
+    def sum(column):
+        return Aggregate('$sum', column)
+
+    @staticmethod
+    def avg(column):
+        return Aggregate('$avg', column)
+
+    @staticmethod
+    def min(column):
+        return Aggregate('$min', column)
+
+    @staticmethod
+    def max(column):
+        return Aggregate('$max', column)
+
+    @staticmethod
+    def first(column):
+        return Aggregate('$first', column)
+
+    @staticmethod
+    def last(column):
+        return Aggregate('$last', column)
+
+    @staticmethod
+    def push(column):
+        return Aggregate('$push', column)
+
+    @staticmethod
+    def add_to_set(column):
+        return Aggregate('$addToSet', column)
+
+
+class Aggregation(object):
+    """
+    the result of Query.agg(), iterating it runs the pipeline and yields one dict
+    per group with the group_by columns and the aggregates.
+
+    sort() and limit() apply to the result rows, the query's own sort, offset and limit
+    select the documents that are grouped.
+    """
+
+    def __init__(self, query, group_by, aggregates):
+        self.query = query
+        self.group_by = [field_name(c) for c in group_by]
+        self.aggregates = aggregates
+        self.sort_ = None
+        self.limit_ = None
+        self.allow_disk_use_ = False
+
+        for name in aggregates:
+            if name in self.group_by or name == '_id':
+                raise ValueError('aggregate %s has the name of a group_by column' % name)
+
+    def sort(self, *args):
+        """
+        sorts the rows by group_by columns or aggregates, same arguments as Query.sort
+
+            >>> agg.sort('count', -1)
+            >>> agg.sort([('count', -1), (User.role, 1)])
+        """
+        self.sort_ = args
+        return self
+
+    def limit(self, i):
+        self.limit_ = i
+        return self
+
+    def allow_disk_use(self, value=True):
+        """lets the server write to temporary files for groupings over its memory limit"""
+        self.allow_disk_use_ = value
+        return self
+
+    def get_group_key(self, name):
+        """where a group_by column ends up in the $group output"""
+        if len(self.group_by) == 1:
+            return '_id'
+        return '_id.%s' % name
+
+    def get_pipeline(self):
+        pipeline = self.query.get_pipeline()
+
+        if not self.group_by:
+            group_id = None
+        elif len(self.group_by) == 1:
+            group_id = '$%s' % self.group_by[0]
+        else:
+            group_id = dict((name, '$%s' % name) for name in self.group_by)
+        group = {'_id': group_id}
+        for name, aggregate in self.aggregates.iteritems():
+            group[name] = aggregate.as_mongo_expression()
+        pipeline.append({'$group': group})
+
+        sort = get_sort(self.sort_)
+        if sort:
+            pipeline.append({'$sort': SON((self.get_group_key(k) if k in self.group_by else k, d)
+                                          for k, d in sort)})
+        if self.limit_:
+            pipeline.append({'$limit': self.limit_})
+        return pipeline
+
+    def get_row(self, document):
+        group_id = document.pop('_id')
+        if len(self.group_by) == 1:
+            document[self.group_by[0]] = group_id
+        elif self.group_by:
+            for name in self.group_by:
+                document[name] = (group_id or {}).get(name)
+        return document
+
+    def __iter__(self):
+        pipeline = self.get_pipeline()
+        kwargs = {}
+        if self.allow_disk_use_:
+            kwargs['allowDiskUse'] = True
+        if self.query.batch_size_:
+            kwargs['batchSize'] = self.query.batch_size_
+        cursor = self.query.get_reader().aggregate(pipeline, **kwargs)
+
+        documents = cursor
+        if events.enabled:
+            event = events.ExecuteEvent(self.query.from_, 'aggregate', criteria=pipeline[0]['$match'],
+                                        sort=get_sort(self.sort_), limit=self.limit_)
+            documents = events.instrument_documents(event, cursor)
+
+        for document in documents:
+            yield self.get_row(document)
+
+    def all(self):
+        return list(self)
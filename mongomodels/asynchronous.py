@@ -0,0 +1,468 @@
+"""
+asynchronous queries and persistence on top of tornado coroutines
+
+models, criterias and hydration are shared with the synchronous api, only the
+database calls go through an AsyncDriver. methods doing i/o return futures,
+you can yield them in a tornado coroutine (or await them on python 3)
+
+    from tornado import gen
+    from mongomodels.asynchronous import AsyncConnection, MotorDriver
+
+    db = AsyncConnection(MotorDriver(motor.MotorClient().testdb))
+
+    @gen.coroutine
+    def handler():
+        user = yield db.query(User).filter(User.age > 10).first()
+        user.age += 1
+        yield db.save(user)
+
+        cursor = db.query(User).filter_by(role='admin').cursor()
+        while (yield cursor.fetch_next):
+            admin = cursor.next_object()
+
+        projects = yield db.related(user, 'projects').all()
+
+MemoryDriver keeps everything in memory so you can test without a server.
+"""
+import copy
+import re
+
+from bson.objectid import ObjectId as ObjectId_
+from tornado import gen
+from tornado.concurrent import Future
+
+from .aggregation import get_sort
+from .base import relationships_reg
+from .cache import query_cache
+from .column import Query, RelationshipBelongsTo, RelationshipHasOne, \
+    RelationshipHasAndBelongsTo, configure_models
+
+
+def resolved(value):
+    """returns a future that is already done"""
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class AsyncDriver(object):
+    """
+    the interface AsyncConnection uses to talk to the database.
+
+    every method takes the name of the collection first. find returns a cursor
+    with a fetch_next property (a future that resolves to False when the cursor is
+    exhausted), next_object() and to_list(length), like motor's cursors.
+    the other methods return futures.
+    """
+
+    def get_full_name(self, collection):
+        """returns the namespace of a collection, eg: testdb.users"""
+        raise NotImplementedError()
+
+    def find(self, collection, criteria, projection=None, sort=None, skip=0, limit=0):
+        raise NotImplementedError()
+
+    def insert_one(self, collection, document):
+        """resolves to the _id of the inserted document"""
+        raise NotImplementedError()
+
+    def update_one(self, collection, criteria, update):
+        raise NotImplementedError()
+
+    def delete_many(self, collection, criteria):
+        """resolves to the number of deleted documents"""
+        raise NotImplementedError()
+
+    def count_documents(self, collection, criteria, limit=0):
+        raise NotImplementedError()
+
+
+class MotorDriver(AsyncDriver):
+    """AsyncDriver for a motor database, eg: MotorDriver(motor.MotorClient().testdb)"""
+
+    def __init__(self, database):
+        self.database = database
+
+    def get_full_name(self, collection):
+        return self.database[collection].full_name
+
+    def find(self, collection, criteria, projection=None, sort=None, skip=0, limit=0):
+        cursor = self.database[collection].find(criteria, projection)
+        if sort:
+            cursor.sort(sort)
+        if skip:
+            cursor.skip(skip)
+        if limit:
+            cursor.limit(limit)
+        return cursor
+
+    @gen.coroutine
+    def insert_one(self, collection, document):
+        result = yield self.database[collection].insert_one(document)
+        raise gen.Return(result.inserted_id)
+
+    def update_one(self, collection, criteria, update):
+        return self.database[collection].update_one(criteria, update)
+
+    @gen.coroutine
+    def delete_many(self, collection, criteria):
+        result = yield self.database[collection].delete_many(criteria)
+        raise gen.Return(result.deleted_count)
+
+    def count_documents(self, collection, criteria, limit=0):
+        kwargs = {}
+        if limit:
+            kwargs['limit'] = limit
+        return self.database[collection].count_documents(criteria, **kwargs)
+
+
+_missing = object()
+
+def _get_path(document, path):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _missing
+        value = value[part]
+    return value
+
+def _equals(value, expected):
+    if isinstance(value, list) and not isinstance(expected, list):
+        return expected in value
+    if value is _missing:
+        return expected is None
+    return value == expected
+
+def _match_condition(value, condition):
+    if not (isinstance(condition, dict) and condition and all(k.startswith('$') for k in condition)):
+        return _equals(value, condition)
+
+    present = value is not _missing
+    for op, arg in condition.iteritems():
+        if op == '$eq':
+            ok = _equals(value, arg)
+        elif op == '$ne':
+            ok = not _equals(value, arg)
+        elif op == '$gt':
+            ok = present and value is not None and value > arg
+        elif op == '$gte':
+            ok = present and value is not None and value >= arg
+        elif op == '$lt':
+            ok = present and value is not None and value < arg
+        elif op == '$lte':
+            ok = present and value is not None and value <= arg
+        elif op == '$in':
+            ok = any(_equals(value, a) for a in arg)
+        elif op == '$nin':
+            ok = not any(_equals(value, a) for a in arg)
+        elif op == '$exists':
+            ok = present == bool(arg)
+        elif op in ('$regex', '$regexp'):
+            ok = present and isinstance(value, basestring) and re.search(arg, value) is not None
+        elif op == '$not':
+            ok = not _match_condition(value, arg)
+        else:
+            raise NotImplementedError('%s is not supported by MemoryDriver' % op)
+        if not ok:
+            return False
+    return True
+
+def matches(document, criteria):
+    """checks if document matches a mongodb query document, supports the common operators"""
+    for key, condition in criteria.iteritems():
+        if key == '$and':
+            ok = all(matches(document, c) for c in condition)
+        elif key == '$or':
+            ok = any(matches(document, c) for c in condition)
+        elif key == '$nor':
+            ok = not any(matches(document, c) for c in condition)
+        else:
+            ok = _match_condition(_get_path(document, key), condition)
+        if not ok:
+            return False
+    return True
+
+
+class MemoryCursor(object):
+
+    def __init__(self, documents):
+        self.documents = documents
+        self.position = 0
+
+    @property
+    def fetch_next(self):
+        return resolved(self.position < len(self.documents))
+
+    def next_object(self):
+        document = self.documents[self.position]
+        self.position += 1
+        return document
+
+    def to_list(self, length=None):
+        end = len(self.documents) if length is None else self.position + length
+        documents = self.documents[self.position:end]
+        self.position += len(documents)
+        return resolved(documents)
+
+
+class MemoryDriver(AsyncDriver):
+    """an AsyncDriver keeping the collections in memory, for tests"""
+
+    def __init__(self, name='memory'):
+        self.name = name
+        self.collections = {}
+
+    def get_full_name(self, collection):
+        return '%s.%s' % (self.name, collection)
+
+    def _documents(self, collection):
+        return self.collections.setdefault(collection, [])
+
+    def _find(self, collection, criteria):
+        return [d for d in self._documents(collection) if matches(d, criteria)]
+
+    def find(self, collection, criteria, projection=None, sort=None, skip=0, limit=0):
+        documents = self._find(collection, criteria)
+        for key, direction in reversed(sort or []):
+            documents.sort(key=lambda d: _get_path(d, key), reverse=direction == -1)
+        documents = documents[skip:]
+        if limit:
+            documents = documents[:limit]
+
+        if projection:
+            inclusive = any(projection.values())
+            projected = []
+            for d in documents:
+                if inclusive:
+                    d = dict((k, v) for k, v in d.iteritems() if projection.get(k) or k == '_id')
+                else:
+                    d = dict((k, v) for k, v in d.iteritems() if k not in projection)
+                projected.append(d)
+            documents = projected
+
+        return MemoryCursor(copy.deepcopy(documents))
+
+    def insert_one(self, collection, document):
+        document = copy.deepcopy(document)
+        document.setdefault('_id', ObjectId_())
+        self._documents(collection).append(document)
+        return resolved(document['_id'])
+
+    def update_one(self, collection, criteria, update):
+        for document in self._find(collection, criteria)[:1]:
+            for key, value in update.get('$set', {}).iteritems():
+                document[key] = copy.deepcopy(value)
+            for key in update.get('$unset', {}):
+                document.pop(key, None)
+        return resolved(None)
+
+    def delete_many(self, collection, criteria):
+        documents = self._documents(collection)
+        kept = [d for d in documents if not matches(d, criteria)]
+        self.collections[collection] = kept
+        return resolved(len(documents) - len(kept))
+
+    def count_documents(self, collection, criteria, limit=0):
+        count = len(self._find(collection, criteria))
+        if limit:
+            count = min(count, limit)
+        return resolved(count)
+
+
+class AsyncCursor(object):
+    """iterates over a query's results, hydrating the documents as they arrive"""
+
+    def __init__(self, query, cursor):
+        self.query = query
+        self.cursor = cursor
+
+    @property
+    def fetch_next(self):
+        return self.cursor.fetch_next
+
+    def next_object(self):
+        return self.query.hydrate(self.cursor.next_object())
+
+
+def synchronous_only(name):
+    """a Query method AsyncQuery can't run, it would read or write through pymongo"""
+    def method(self, *args, **kwargs):
+        raise TypeError('AsyncQuery does not support %s(), it runs on the synchronous connection' % name)
+    method.__name__ = name
+    return method
+
+
+class AsyncQuery(Query):
+    """
+    a Query whose results are loaded through an AsyncConnection, filtering,
+    sorting and projections work the same way. instances are bound to the
+    AsyncConnection, they are saved with db.save(instance)
+    """
+
+    def __init__(self, from_, async_connection):
+        self.async_connection = async_connection
+        super(AsyncQuery, self).__init__(from_=from_, connection=async_connection)
+
+    @property
+    def driver(self):
+        return self.async_connection.driver
+
+    def get_connection(self):
+        raise TypeError('AsyncQuery has no pymongo collection, use its driver')
+
+    get_reader = get_connection
+
+    # everything below goes through pymongo, there is no asynchronous version yet
+    using = synchronous_only('using')
+    read_preference = synchronous_only('read_preference')
+    compile = synchronous_only('compile')
+    options = synchronous_only('options')
+    cached = synchronous_only('cached')
+    get_cursor = synchronous_only('get_cursor')
+    get_documents = synchronous_only('get_documents')
+    paginate_after = synchronous_only('paginate_after')
+    values = synchronous_only('values')
+    scalars = synchronous_only('scalars')
+    as_dicts = synchronous_only('as_dicts')
+    to_columns = synchronous_only('to_columns')
+    group_by = synchronous_only('group_by')
+    agg = synchronous_only('agg')
+    explain = synchronous_only('explain')
+    update = synchronous_only('update')
+    yield_per = synchronous_only('yield_per')
+    stream = synchronous_only('stream')
+    parallel_iter = synchronous_only('parallel_iter')
+    parallel_map = synchronous_only('parallel_map')
+
+    def find(self, criteria, projection, limit=None):
+        if relationships_reg:
+            configure_models()
+        return self.driver.find(self.from_.__collection__, criteria, projection,
+                                sort=get_sort(self.sort_), skip=self.offset_ or 0,
+                                limit=limit or self.limit_ or 0)
+
+    def cursor(self):
+        """
+        :rtype: AsyncCursor
+        """
+        return AsyncCursor(self, self.find(self.get_criteria(), self.projection_))
+
+    def __iter__(self):
+        raise TypeError('AsyncQuery can not be iterated synchronously, use cursor() or all()')
+
+    @gen.coroutine
+    def all(self):
+        documents = yield self.find(self.get_criteria(), self.projection_).to_list(None)
+        raise gen.Return([self.hydrate(d) for d in documents])
+
+    @gen.coroutine
+    def first(self):
+        documents = yield self.find(self.get_criteria(), self.projection_, limit=1).to_list(1)
+        raise gen.Return(self.hydrate(documents[0]) if documents else None)
+
+    @gen.coroutine
+    def one(self):
+        documents = yield self.find(self.get_criteria(), self.projection_, limit=2).to_list(2)
+        assert documents, "expected one object"
+        assert len(documents) == 1, "expected one object, more than one received"
+        raise gen.Return(self.hydrate(documents[0]))
+
+    def count(self, limit=None, ttl=None):
+        return self.driver.count_documents(self.from_.__collection__, self.get_criteria(), limit or 0)
+
+    @gen.coroutine
+    def delete(self):
+        deleted = yield self.driver.delete_many(self.from_.__collection__, self.get_criteria())
+        query_cache.invalidate(self.driver.get_full_name(self.from_.__collection__))
+        raise gen.Return(deleted)
+
+
+class AsyncConnection(object):
+    """
+    asynchronous counterpart of Connection, wraps an AsyncDriver
+    """
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    @property
+    def pymongo_connection(self):
+        # reached when an instance loaded through this connection is used synchronously,
+        # eg: user.save() or user.projects, instead of db.save(user) or db.related(user, 'projects')
+        raise TypeError('instances of an AsyncConnection are saved and loaded through it, '
+                        'eg: db.save(instance), db.related(instance, name)')
+
+    def get_reader(self, collection, read_preference=None):
+        return self.pymongo_connection
+
+    def query(self, model_class):
+        """
+        :rtype: AsyncQuery
+        """
+        return AsyncQuery(model_class, self)
+
+    def get_by_id(self, model_class, object_id):
+        return self.query(model_class).filter({'_id': ObjectId_(object_id)}).first()
+
+    @gen.coroutine
+    def save(self, instance):
+        """inserts or updates the instance, only changed columns are sent on update"""
+        instance.validate()
+        collection = instance.__collection__
+        if instance._id:
+            document = instance.get_update_document()
+            if not document:
+                return
+            yield self.driver.update_one(collection, {'_id': instance._id}, document)
+        else:
+            document = instance.as_document()
+            document.pop('_id')
+            instance._id = yield self.driver.insert_one(collection, document)
+        instance.__connection__ = self
+        instance._clear_dirty()
+        query_cache.invalidate(self.driver.get_full_name(collection))
+
+    @gen.coroutine
+    def delete(self, instance):
+        collection = instance.__collection__
+        yield self.driver.delete_many(collection, {'_id': instance._id})
+        query_cache.invalidate(self.driver.get_full_name(collection))
+
+    def related(self, instance, name):
+        """
+        asynchronous version of relationship properties, eg: db.related(user, 'projects')
+
+        returns an AsyncQuery for the children of a belongs_to relationship, a future
+        resolving to the parent for the reverse side, and a future resolving to the list
+        of related instances for has_and_belongs_to relationships.
+        """
+        if relationships_reg:
+            configure_models()
+
+        relationship = None
+        for klass in type(instance).__mro__:
+            if name in klass.__dict__:
+                relationship = klass.__dict__[name]
+                break
+
+        if isinstance(relationship, RelationshipBelongsTo):
+            return self.query(relationship.klass).filter({relationship.rel_column: instance._id})
+        if isinstance(relationship, RelationshipHasOne):
+            rel_id = getattr(instance, relationship.rel_column)
+            if rel_id is None:
+                return resolved(None)
+            return self.query(relationship.other).filter({'_id': rel_id}).first()
+        if isinstance(relationship, RelationshipHasAndBelongsTo):
+            return self._related_through(instance, relationship)
+        raise ValueError('%s has no relationship named %s' % (type(instance).__name__, name))
+
+    @gen.coroutine
+    def _related_through(self, instance, relationship):
+        # same as RelationshipQueryThrough, links first, then one $in query
+        links = yield self.driver.find(relationship.through.__collection__,
+                                       {relationship.right_id_column.name: instance._id},
+                                       {relationship.left_id_column.name: True}).to_list(None)
+        ids = [link.get(relationship.left_id_column.name) for link in links]
+        related = yield self.query(relationship.left).filter({'_id': {'$in': ids}}).all()
+        found = dict((r._id, r) for r in related)
+        raise gen.Return([found[id_] for id_ in ids if id_ in found])
@@ -0,0 +1,95 @@
+from collections import OrderedDict
+import copy
+import threading
+import time
+
+
+class QueryCache(object):
+    """
+    an LRU cache for query results, used by Query.cached()
+
+    results are kept per collection, any write to a collection made through mongomodels
+    in this process (save, delete, insert_many, Query.delete, Session.flush) drops
+    the cached results of that collection. writes made by other processes are only
+    seen after the entries expire.
+    """
+
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.keys_by_collection = {}
+        # bumped by invalidate() and clear(), results loaded meanwhile are not kept
+        self.generations = {}
+        self.clears = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, collection, key, ttl, load):
+        """
+        returns the documents cached for key, or calls load() and caches what it returns.
+        documents are copied so changes on the returned documents don't leak into the cache.
+
+        :param collection: full name of the collection the result comes from, or a tuple of
+            them when it depends on several. key starts with it
+        """
+        collections = collection if isinstance(collection, tuple) else (collection,)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                # most recently used goes to the end
+                self.entries[key] = entry
+                self.hits += 1
+                return copy.deepcopy(entry[1])
+            self.misses += 1
+            generation = self.get_generation(collections)
+
+        documents = load()
+
+        with self.lock:
+            if self.get_generation(collections) != generation:
+                # invalidated while loading, the documents may be older than the write
+                return documents
+            self.entries[key] = (now + ttl, documents)
+            for name in collections:
+                self.keys_by_collection.setdefault(name, set()).add(key)
+            while len(self.entries) > self.max_size:
+                old_key, _ = self.entries.popitem(last=False)
+                old_collections = old_key[0] if isinstance(old_key[0], tuple) else (old_key[0],)
+                for name in old_collections:
+                    self.keys_by_collection.get(name, set()).discard(old_key)
+                self.evictions += 1
+        return copy.deepcopy(documents)
+
+    def get_generation(self, collections):
+        return self.clears, tuple(self.generations.get(name, 0) for name in collections)
+
+    def invalidate(self, collection):
+        """drops all the cached results of a collection, eg: 'testdb.users'"""
+        with self.lock:
+            self.generations[collection] = self.generations.get(collection, 0) + 1
+            keys = self.keys_by_collection.pop(collection, None)
+            if not keys:
+                return
+            for key in keys:
+                self.entries.pop(key, None)
+            self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.keys_by_collection = {}
+            self.clears += 1
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'size': len(self.entries)}
+
+
+query_cache = QueryCache()
@@ -1,5 +1,19 @@
 from bson.objectid import ObjectId as ObjectId_
+from bson import BSON
+from bson.son import SON
+from pymongo import IndexModel, ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from pymongo.results import UpdateResult
+import base64
+import copy
+import threading
+import time
 from .base import relationships_reg, model_registery, connections
+from .cache import query_cache
+from . import events
+from .parallel import parallel_scan
+from .explain import Explain
+from .aggregation import Aggregation, get_sort
 import inflection
 import logging
 
@@ -8,6 +22,26 @@ logger = logging.getLogger(__name__)
 class ValidationError(Exception):
     pass
 
+class ConfigurationError(Exception):
+    pass
+
+class BulkInsertResult(object):
+    """
+    returned from MongoModel.insert_many
+
+    inserted is the list of instances that made it to the database, errors is a list of
+    (instance, error) tuples, error is either a ValidationError or the write error
+    document returned by the server. not_inserted are the instances never sent because
+    an ordered insert stopped at a failure
+    """
+    def __init__(self):
+        self.inserted = []
+        self.errors = []
+        self.not_inserted = []
+
+    def __repr__(self):
+        return '<BulkInsertResult inserted:%s errors:%s>' % (len(self.inserted), len(self.errors))
+
 class ColumnType(object):
 
     def __init__(self, required=False, validator=None):
@@ -135,6 +169,72 @@ class Criteria(object):
         return '<Criteria %s>' % self.as_mongo_expression()
 
 
+class Update(object):
+    """an atomic update of one column, see Column.inc, push, pull and set_on_insert"""
+
+    def __init__(self, op, column, value):
+        self.op = op
+        self.column = column
+        self.value = value
+
+    def as_mongo_expression(self):
+        return {self.op: {column_name(self.column): self.value}}
+
+    def __repr__(self):
+        return '<Update %s>' % self.as_mongo_expression()
+
+
+def compile_update(updates, values=None):
+    """
+    builds an update document from Update's and dicts of column (or name) to value,
+    plain values are $set and None is $unset
+
+        >>> compile_update([User.views.inc(1), {User.name: 'foo'}])
+        {'$inc': {'views': 1}, '$set': {'name': 'foo'}}
+    """
+    document = {}
+    items = []
+    for update in updates:
+        if isinstance(update, Update):
+            items.append((update.column, update))
+        else:
+            items.extend(update.iteritems())
+    if values:
+        items.extend(values.iteritems())
+
+    for column, value in items:
+        name = column_name(column)
+        if isinstance(value, Update):
+            op, value = value.op, value.value
+        elif value is None:
+            op, value = '$unset', ''
+        else:
+            op = '$set'
+        document.setdefault(op, {})[name] = value
+    if not document:
+        raise ValueError('nothing to update')
+    return document
+
+
+class BindParam(object):
+    """a placeholder for a value given when a compiled query is executed, see bindparam()"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __repr__(self):
+        return '<BindParam %s>' % self.name
+
+def bindparam(name):
+    """
+    a named placeholder to use in place of a value in criterias of a compiled query
+
+        >>> by_age = User.query.filter(User.age > bindparam('min_age')).compile()
+        >>> by_age.all(min_age=10)
+    """
+    return BindParam(name)
+
+
 class NestedCriteria(object):
     def __init__(self, op, args):
         self.op = op
@@ -167,7 +267,20 @@ def nor_(*args):
 class Column(object):
 
     def __init__(self, *args, **kwargs):
+        """
+        :param index: create an index on this column with sync_indexes(), True for an
+            ascending index or a direction, eg: pymongo.DESCENDING, 'hashed'
+        :param unique: the index is unique (implies index)
+        :param sparse: the index skips documents without this column, needs index or unique
+        the rest of the keyword arguments are passed to the ColumnType
+        """
         self._column_type = None
+        self.default_value = None
+        self.index = kwargs.pop('index', False)
+        self.unique = kwargs.pop('unique', False)
+        self.sparse = kwargs.pop('sparse', False)
+        if self.sparse and not (self.index or self.unique):
+            raise ConfigurationError('sparse only applies to an index, use it with index=True or unique=True')
         for arg in args:
 
             if issubclass(arg, ColumnType):
@@ -185,12 +298,63 @@ class Column(object):
             self._column_type = Any()
 
 
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        try:
+            value = instance.__dict__[self.name]
+        except KeyError:
+            # the column wasn't loaded by a query with only() or defer()
+            if self.name in instance.__dict__.get('__deferred__', ()):
+                instance.load_deferred()
+                return instance.__dict__.get(self.name, self.default_value)
+            return self.default_value
+
+        if isinstance(value, (list, dict)):
+            # lists and dicts can be changed in place without an assignment, a copy taken
+            # the first time they are read tells update() if they changed
+            snapshots = instance.__dict__.setdefault('__snapshots__', {})
+            if self.name not in snapshots:
+                snapshots[self.name] = copy.deepcopy(value)
+        return value
+
+    def __set__(self, instance, value):
+        """
+        values are kept in the instance's __dict__, every assignment marks the column
+        as dirty so update() only sends what changed
+        """
+        d = instance.__dict__
+        d[self.name] = value
+        d.setdefault('__dirty__', set()).add(self.name)
+        if self.name in d.get('__deferred__', ()):
+            d['__deferred__'] = d['__deferred__'] - set([self.name])
+
     def validate(self, value):
         return self._column_type.validate(value)
 
     def in_(self, other):
         return Criteria(op="$in", left=self, right=other)
 
+    def inc(self, amount=1):
+        """atomic increment, for Query.update() and instance.inc()"""
+        return Update('$inc', self, amount)
+
+    def set_on_insert(self, value):
+        """sets the column only when an upsert inserts the document"""
+        return Update('$setOnInsert', self, value)
+
+    def push(self, *values):
+        """appends values to an array column"""
+        if len(values) == 1:
+            return Update('$push', self, values[0])
+        return Update('$push', self, {'$each': list(values)})
+
+    def pull(self, *values):
+        """removes all occurrences of values from an array column"""
+        if len(values) == 1:
+            return Update('$pull', self, values[0])
+        return Update('$pull', self, {'$in': list(values)})
+
     def nin_(self, other):
         return Criteria(op="$nin", left=self, right=other)
 
@@ -265,6 +429,17 @@ class Column(object):
         """
         raise Exception('not implemented')
 
+def column_by_name(instance, column):
+    if isinstance(column, Column):
+        return column
+    return instance.__columns__[column]
+
+def column_name(column):
+    """returns the name of a column, accepts Column instances or names"""
+    if isinstance(column, Column):
+        return column.name
+    return column
+
 class MongoModelMeta(type):
 
     def __init__(cls, name, bases, dct):
@@ -298,77 +473,100 @@ class classproperty(property):
 def create_through_class(left, right, left_column_name, right_column_name):
     name = '%s%s' % (right.__name__, left.__name__)
     through_class = type(name, (MongoModel,), {
-        left_column_name: Column(ObjectId),
-        right_column_name: Column(ObjectId)
+        left_column_name: Column(ObjectId, index=True),
+        right_column_name: Column(ObjectId, index=True),
+        '__indexes__': [IndexModel([(left_column_name, ASCENDING), (right_column_name, ASCENDING)],
+                                   unique=True)]
     })
     return through_class
 
-def process_any_remaining_relationships():
-    t = []
-    for rel in relationships_reg:
-        if rel['relationship'] == 'has_and_belongs_to':
-            left = model_registery.get(rel['called_in_class'])
-            if isinstance(rel['other'], str):
-                right = model_registery.get(rel['other'].capitalize())
-            else:
-                right = rel['other']
-
-            if rel['through']:
-                # just sanity check
-                through_class = rel['through']
-                left_id_col = getattr(through_class, '%s_id' % inflection.singularize(left.__name__).lower())
-                right_id_col = getattr(through_class, '%s_id' % inflection.singularize(right.__name__).lower())
-                RelationshipHasAndBelongsTo(left, right,
-                                            through=through_class,
-                                            left_id_column=left_id_col, right_id_column=right_id_col)
-
-                # now we swap and add another relationship
-                RelationshipHasAndBelongsTo(right, left,
-                                            through=through_class,
-                                            left_id_column=right_id_col,
-                                            right_id_column=left_id_col)
-
-                t.append(rel)
-            else:
-                # we now create a through class
-                left_id_col_name = '%s_id' % inflection.singularize(left.__name__).lower()
-                right_id_col_name ='%s_id' % inflection.singularize(right.__name__).lower()
-
-                through_class = create_through_class(left, right, left_id_col_name, right_id_col_name)
+def _resolve_model(rel, klass_or_name):
+    if not isinstance(klass_or_name, basestring):
+        return klass_or_name
 
-                left_id_col = getattr(through_class, '%s_id' % inflection.singularize(left.__name__).lower())
-                right_id_col = getattr(through_class, '%s_id' % inflection.singularize(right.__name__).lower())
+    klass = model_registery.get(klass_or_name) or \
+        model_registery.get(inflection.camelize(klass_or_name))
+    if klass is None:
+        raise ConfigurationError('%s relationship in %s refers to an unknown model: %s' %
+                                 (rel['relationship'], rel['called_in_class'], klass_or_name))
+    return klass
 
+def _configure_relationship(rel):
+    klass = _resolve_model(rel, rel['called_in_class'])
+    other = _resolve_model(rel, rel['other'])
 
-                RelationshipHasAndBelongsTo(left, right,
-                                            through=through_class,
-                                            left_id_column=left_id_col, right_id_column=right_id_col)
+    if rel['relationship'] == 'has_and_belongs_to':
+        left, right = klass, other
+        left_id_col_name = '%s_id' % inflection.singularize(left.__name__).lower()
+        right_id_col_name = '%s_id' % inflection.singularize(right.__name__).lower()
 
-                # now we swap and add another relationship
-                RelationshipHasAndBelongsTo(right, left,
-                                            through=through_class,
-                                            left_id_column=right_id_col,
-                                            right_id_column=left_id_col)
-
-                t.append(rel)
+        if rel['through']:
+            through_class = rel['through']
+        else:
+            # we now create a through class
+            through_class = create_through_class(left, right, left_id_col_name, right_id_col_name)
+
+        # just sanity check
+        for col_name in (left_id_col_name, right_id_col_name):
+            if col_name not in through_class.__columns__:
+                raise ConfigurationError('%s needs a %s column for the relationship between %s and %s' %
+                                         (through_class.__name__, col_name, left.__name__, right.__name__))
+        left_id_col = through_class.__columns__[left_id_col_name]
+        right_id_col = through_class.__columns__[right_id_col_name]
+        # relationship queries filter on both sides
+        left_id_col.index = left_id_col.index or True
+        right_id_col.index = right_id_col.index or True
+
+        RelationshipHasAndBelongsTo(left, right,
+                                    through=through_class,
+                                    left_id_column=left_id_col, right_id_column=right_id_col)
+
+        # now we swap and add another relationship
+        RelationshipHasAndBelongsTo(right, left,
+                                    through=through_class,
+                                    left_id_column=right_id_col,
+                                    right_id_column=left_id_col)
+
+    elif rel['relationship'] == 'belongs_to':
+        RelationshipBelongsTo(klass, other, rel_column=rel['rel_column'], backref=rel['backref'])
+    else:
+        raise ConfigurationError('unknown relationship type - %s' % rel['relationship'])
+
+# reentrant, configuring a relationship may create a model that configures them too
+_configure_lock = threading.RLock()
+
+def configure_models():
+    """
+    sets up the relationships declared with belongs_to and has_and_belongs_to.
 
-        elif rel['relationship'] == 'belongs_to':
-            # are we yet defined
-            klass = model_registery.get(rel['called_in_class'])
-            if isinstance(rel['other'], str):
-                other = model_registery.get(rel['other'].capitalize())
-            else:
-                other = rel['other']
+    this runs automatically the first time a model is instantiated or queried, and again only
+    if new relationships are declared after that. you can call it yourself once all your models
+    are imported to catch configuration errors at startup.
 
-            if klass and other:
-                rel.pop('other')
-                RelationshipBelongsTo(klass, other, **rel)
-                t.append(rel)
-        else:
-            raise Exception('unknown relationship type - %s' % rel['relationship'])
+    raises ConfigurationError if a relationship refers to a model that doesn't exist.
+    """
+    with _configure_lock:
+        # checked again with the lock held, another thread may have configured them meanwhile.
+        # an entry is removed only once its relationship is set up
+        while relationships_reg:
+            _configure_relationship(relationships_reg[0])
+            relationships_reg.pop(0)
+
+def sync_indexes(connection=None):
+    """
+    creates the indexes declared on all models that are missing in the database,
+    with one create_indexes call per collection. call it once at startup, after
+    importing your models.
 
-    for r in t:
-        relationships_reg.remove(r)
+    returns a dict of collection name to the names of the created indexes.
+    """
+    configure_models()
+    created = {}
+    for model in set(model_registery.values()):
+        names = model.sync_indexes(connection)
+        if names:
+            created[model.__collection__] = names
+    return created
 
 class MongoModel(object):
     __metaclass__ = MongoModelMeta
@@ -377,8 +575,10 @@ class MongoModel(object):
 
     def __init__(self, **kwargs):
 
-        process_any_remaining_relationships()
+        if relationships_reg:
+            configure_models()
 
+        self.__dirty__ = set()
         for k, v in self.__columns__.iteritems():
             setattr(self, k, getattr(v, 'default_value'))
 
@@ -387,6 +587,108 @@ class MongoModel(object):
         for k, v in kwargs.iteritems():
             setattr(self, k, v)
 
+    @classmethod
+    def _from_document(cls, document, connection=None, deferred=None):
+        """
+        fast path to create an instance from a document loaded from the database.
+
+        unlike __init__ this doesn't process relationships or assign defaults, the document
+        is copied into the instance's __dict__ in one step. columns missing from the
+        document fall back to their default value when they are read.
+
+        :param deferred: names of the columns left out by the query's projection,
+            they are loaded with one query the first time one of them is read
+        """
+        instance = cls.__new__(cls)
+        instance.__dict__.update(document)
+        instance.__dirty__ = set()
+        instance.__connection__ = connection or connections.get_default()
+        if deferred:
+            instance.__deferred__ = deferred
+        return instance
+
+    def load_deferred(self):
+        """loads all the columns left out by only() or defer() with one query"""
+        deferred = self.__dict__.get('__deferred__')
+        if not deferred:
+            return
+        self.__deferred__ = frozenset()
+
+        projection = dict((name, True) for name in deferred)
+        document = self.get_connection()[self.__collection__].find_one({'_id': self._id}, projection)
+        for name in deferred:
+            if document and name in document and name not in self.__dict__:
+                self.__dict__[name] = document[name]
+
+    def get_dirty_columns(self):
+        """
+        returns the names of the columns changed since the instance was loaded or saved,
+        assigned ones and lists or dicts changed in place, eg: user.tags.append('foo')
+        """
+        dirty = set(self.__dirty__)
+        for name, value in self.__dict__.get('__snapshots__', {}).iteritems():
+            if name not in dirty and self.__dict__.get(name) != value:
+                dirty.add(name)
+        return dirty
+
+    def mark_dirty(self, *column_names):
+        """
+        makes sure columns are sent on the next save(), eg: when a list kept from
+        before the last save() is changed in place
+
+            >>> user.mark_dirty('tags')
+        """
+        for name in column_names:
+            if isinstance(name, Column):
+                name = name.name
+            self.__dirty__.add(name)
+
+    def _clear_dirty(self):
+        self.__dirty__.clear()
+        self.__dict__.pop('__snapshots__', None)
+
+    def apply_updates(self, *updates):
+        """
+        sends atomic updates for this instance and sets the changed columns to the values
+        the server has after the update, in one round trip. nothing else is saved.
+
+            >>> user.apply_updates(User.views.inc(1), User.tags.push('new'))
+        """
+        document = compile_update(updates)
+        names = set()
+        for columns in document.itervalues():
+            names.update(name.split('.')[0] for name in columns)
+
+        criteria = {'_id': self._id}
+        collection = self.get_connection()[self.__collection__]
+        with events.execute(self.__class__, 'update', criteria=criteria):
+            result = collection.find_one_and_update(criteria, document,
+                                                    projection=dict((name, True) for name in names),
+                                                    return_document=ReturnDocument.AFTER)
+        query_cache.invalidate(collection.full_name)
+        if result is None:
+            raise ValueError('%s %s is not in the database' % (self.__class__.__name__, self._id))
+
+        for name in names:
+            self.__dict__[name] = result.get(name)
+            self.__dirty__.discard(name)
+            self.__dict__.get('__snapshots__', {}).pop(name, None)
+            if name in self.__dict__.get('__deferred__', ()):
+                self.__dict__['__deferred__'] = self.__dict__['__deferred__'] - set([name])
+        return self
+
+    def inc(self, column, amount=1):
+        """atomically increments a column, eg: user.inc(User.views)"""
+        return self.apply_updates(column_by_name(self, column).inc(amount))
+
+    def push(self, column, *values):
+        """atomically appends values to an array column"""
+        return self.apply_updates(column_by_name(self, column).push(*values))
+
+    def pull(self, column, *values):
+        """atomically removes values from an array column"""
+        return self.apply_updates(column_by_name(self, column).pull(*values))
+
     def set_connection(self, connection):
         self.__connection__ = connection
         return self
@@ -417,54 +719,522 @@ class MongoModel(object):
     def query_from_connection(self, connection):
         return Query(from_=self, connection=connection)
 
+    @classmethod
+    def estimated_count(cls, connection=None):
+        """
+        number of documents in the collection, read from the collection's metadata
+        so it doesn't scan anything. it can be off after an unclean shutdown.
+        """
+        connection = connection or connections.get_default()
+        return connection.get_reader(cls.__collection__).estimated_document_count()
+
     @classmethod
     def get_by_id(cls, object_id):
         from bson import json_util, ObjectId as BsonObjectId
 
         return cls.query.filter_by(_id= BsonObjectId(object_id)).first()
 
+    @classmethod
+    def upsert(cls, criteria, values=None, connection=None):
+        """
+        updates the document matching criteria or inserts it, with one find_one_and_update.
+        returns the instance as it is after the update. the equality conditions of criteria
+        are written to inserted documents.
+
+            >>> User.upsert({User.email: 'foo@example.com'}, {User.name: 'foo', 'visits': User.visits.inc(1)})
+
+        :param criteria: dict of column (or name) to value
+        :param values: dict or list of updates like Query.update() takes, values set with
+            Column.set_on_insert are only written when the document is inserted
+        :raises ValidationError: if the inserted document would be invalid, eg: a required
+            column set neither by criteria nor by values
+        """
+        criteria = dict((column_name(k), v) for k, v in criteria.iteritems())
+        # what an insert copies from criteria, operators like {'$gt': 5} aren't written
+        equalities = dict((k, v) for k, v in criteria.iteritems() if not k.startswith('$') and
+                          not (isinstance(v, dict) and any(op.startswith('$') for op in v)))
+        if values:
+            document = compile_update(values if isinstance(values, (list, tuple)) else [values])
+        elif equalities:
+            # an update can't be empty
+            document = {'$setOnInsert': equalities}
+        else:
+            raise ValueError('nothing to insert, criteria has no equality conditions '
+                             'and there are no values')
+        cls.validate_upsert(equalities, document)
+
+        connection = connection or connections.get_default()
+        collection = connection.pymongo_connection[cls.__collection__]
+        with events.execute(cls, 'upsert', criteria=criteria):
+            try:
+                result = collection.find_one_and_update(criteria, document, upsert=True,
+                                                        return_document=ReturnDocument.AFTER)
+            except DuplicateKeyError:
+                # a concurrent upsert inserted the document first (there is a unique index
+                # on criteria), now it matches
+                result = collection.find_one_and_update(criteria, document, upsert=True,
+                                                        return_document=ReturnDocument.AFTER)
+        query_cache.invalidate(collection.full_name)
+        return cls._from_document(result, connection)
+
+    @classmethod
+    def validate_upsert(cls, equalities, document):
+        """
+        validates the document an upsert would insert, the values written and the
+        required columns, which have to be set by the criteria or the update
+        """
+        inserted = dict(equalities)
+        inserted.update(document.get('$set', {}))
+        inserted.update(document.get('$setOnInsert', {}))
+        for name, value in inserted.iteritems():
+            column = cls.__columns__.get(name)
+            if column is not None and not column.validate(value):
+                raise ValidationError('validation error on Column: %s - value: %s' % (name, value))
+
+        written = set(name for name, value in inserted.iteritems() if value is not None)
+        for op, columns in document.iteritems():
+            if op not in ('$set', '$setOnInsert', '$unset'):
+                written.update(name.split('.')[0] for name in columns)
+        for name, column in cls.__columns__.iteritems():
+            if name != '_id' and column._column_type.required and name not in written:
+                raise ValidationError('validation error on Column: %s - value: None, an upsert '
+                                      'inserting the document would leave it out' % name)
+
+    @classmethod
+    def get_or_create(cls, defaults=None, **criteria):
+        """
+        returns the instance matching criteria, inserting it if there is none, in one round trip
+
+            >>> tag = Tag.get_or_create(name='python', defaults={'color': 'blue'})
+
+        :param defaults: values only written when the document is inserted
+        """
+        values = None
+        if defaults:
+            values = [Update('$setOnInsert', k, v) for k, v in defaults.iteritems()]
+        return cls.upsert(criteria, values)
+
+    @classmethod
+    def get_indexes(cls):
+        """
+        returns the IndexModel's declared with Column(index=True, unique=True, sparse=True) and
+        __indexes__. __indexes__ is a list of IndexModel's or key lists for compound and TTL indexes
+
+            >>> class Event(MongoModel):
+            ...     __indexes__ = [[('user_id', 1), ('created_at', -1)],
+            ...                    IndexModel('created_at', expireAfterSeconds=3600)]
+        """
+        indexes = []
+        for name, column in sorted(cls.__columns__.iteritems()):
+            if name == '_id' or not (column.index or column.unique):
+                continue
+            direction = ASCENDING if column.index in (True, False) else column.index
+            kwargs = {}
+            if column.unique:
+                kwargs['unique'] = True
+            if column.sparse:
+                kwargs['sparse'] = True
+            indexes.append(IndexModel([(name, direction)], **kwargs))
+
+        for index in getattr(cls, '__indexes__', ()):
+            if not isinstance(index, IndexModel):
+                index = IndexModel(index)
+            indexes.append(index)
+        return indexes
+
+    @classmethod
+    def sync_indexes(cls, connection=None):
+        """
+        creates the declared indexes that don't exist on the collection, returns their names.
+        indexes are never dropped, an existing index with the same keys but different options
+        is logged and left alone.
+        """
+        connection = connection or connections.get_default()
+        collection = connection.pymongo_connection[cls.__collection__]
+
+        existing = {}
+        for name, info in collection.index_information().iteritems():
+            info = dict(info, name=name)
+            existing[tuple((k, int(d) if isinstance(d, float) else d) for k, d in info['key'])] = info
+
+        missing = []
+        for index in cls.get_indexes():
+            document = index.document
+            info = existing.get(tuple(document['key'].items()))
+            if info is None:
+                missing.append(index)
+                continue
+            for option in ('unique', 'sparse', 'expireAfterSeconds'):
+                if document.get(option) != info.get(option) and (document.get(option) or info.get(option)):
+                    logger.warning('index %s on %s has %s=%s but %s declares %s=%s',
+                                   info['name'], collection.full_name, option,
+                                   info.get(option), cls.__name__, option, document.get(option))
+
+        if missing:
+            collection.create_indexes(missing)
+        return [index.document['name'] for index in missing]
+
     def validate(self):
+        deferred = self.__dict__.get('__deferred__', ())
         for k, v in self.__class__.__columns__.iteritems():
+            if k in deferred:
+                # not loaded, and we won't send it either
+                continue
             if not v.validate(getattr(self, k)):
                 raise ValidationError('validation error on Column: %s - value: %s' % (k, getattr(self, k)))
 
-    def insert(self):
+    def as_document(self):
         obj = {}
         for k, v in self.__columns__.iteritems():
             obj[k] = getattr(self, k)
+        return obj
+
+    def insert(self):
+        obj = self.as_document()
         obj.pop('_id')
-        self._id = self.get_connection()[self.__collection__].insert(obj)
+        collection = self.get_connection()[self.__collection__]
+        with events.execute(self.__class__, 'insert'):
+            self._id = collection.insert(obj)
+        self._clear_dirty()
+        query_cache.invalidate(collection.full_name)
+
+    @classmethod
+    def insert_many(cls, instances, ordered=False, batch_size=1000, connection=None):
+        """inserts instances with one insert_many round trip per batch
+
+        every instance is validated before it is sent, instances that fail validation are skipped and
+        are reported in the result with their ValidationError. write errors returned by the
+        server (eg: duplicate keys) are reported the same way, the rest of the batch
+        is still inserted unless ordered is True, in which case we stop at the first failure
+        like mongodb does and the instances after it are in the result's not_inserted.
+
+        generated _id's are written back to the inserted instances, instances which already
+        have an _id are inserted with it.
+
+        :param instances: iterable of instances of this model
+        :param ordered: stop at the first failure
+        :param batch_size: number of documents sent per insert_many call,
+            pymongo still splits a batch if it goes over the server's message size limits
+        :param connection: Connection to use, defaults to the default connection
+        :rtype: BulkInsertResult
+        """
+        connection = connection or connections.get_default()
+        collection = connection.pymongo_connection[cls.__collection__]
+        result = BulkInsertResult()
+
+        instances = iter(instances)
+        batch = []
+        for instance in instances:
+            try:
+                instance.validate()
+            except ValidationError as e:
+                result.errors.append((instance, e))
+                if ordered:
+                    break
+                continue
+
+            batch.append(instance)
+            if len(batch) >= batch_size:
+                succeeded = cls._insert_batch(collection, batch, ordered, result)
+                batch = []
+                if ordered and not succeeded:
+                    break
+
+        if batch:
+            cls._insert_batch(collection, batch, ordered, result)
+        # left over when an ordered insert stopped early
+        result.not_inserted.extend(instances)
+        return result
+
+    @classmethod
+    def _insert_batch(cls, collection, batch, ordered, result):
+        """sends one batch, returns False if there were any write errors"""
+        docs = []
+        for instance in batch:
+            doc = instance.as_document()
+            if doc.get('_id') is None:
+                doc.pop('_id')
+            docs.append(doc)
+
+        failed = cls._send_batch(collection, docs, ordered)
+
+        # pymongo sets the generated _id on the documents it sends
+        for i, (instance, doc) in enumerate(zip(batch, docs)):
+            if i in failed:
+                result.errors.append((instance, failed[i]))
+            elif ordered and failed and i > min(failed):
+                # never sent
+                result.not_inserted.append(instance)
+            else:
+                instance._id = doc['_id']
+                instance._clear_dirty()
+                result.inserted.append(instance)
+
+        return not failed
+
+    @classmethod
+    def _send_batch(cls, collection, docs, ordered):
+        """inserts documents with one insert_many, returns the write errors by index"""
+        failed = {}
+        with events.execute(cls, 'insert_many') as event:
+            try:
+                collection.insert_many(docs, ordered=ordered)
+            except BulkWriteError as e:
+                for error in e.details.get('writeErrors', []):
+                    failed[error['index']] = error
+            if event is not None:
+                event.documents = len(docs) - len(failed)
+        query_cache.invalidate(collection.full_name)
+        return failed
+
+    @classmethod
+    def dump(cls, path, query=None, format=None):
+        """
+        writes the documents of query (all documents by default) to a file, returns how many
+        were written. documents are streamed, nothing is hydrated.
+
+            >>> User.dump('users.bson')
+            >>> User.dump('admins.jsonl', query=User.query.filter_by(role='admin'))
+
+        :param format: 'bson' (what mongodump writes) or 'jsonl', one extended json document per line,
+            guessed from the file extension by default
+        """
+        from .dump import dump
+        return dump(cls, path, query=query, format=format)
+
+    @classmethod
+    def load(cls, path, format=None, batch_size=1000, ordered=False, validate=True, connection=None):
+        """
+        inserts the documents of a file written by dump() (or mongodump) with one insert_many
+        per batch. documents keep their _id and all their fields.
+
+            >>> User.load('users.bson')
+            <LoadResult inserted:10000 errors:0>
+
+        :param format: 'bson' or 'jsonl', guessed from the file extension by default
+        :param validate: check documents against the model's columns, invalid documents
+            are reported in the result and skipped
+        :param ordered: stop at the first invalid document or write error
+        :rtype: mongomodels.dump.LoadResult
+        """
+        from .dump import load
+        return load(cls, path, format=format, batch_size=batch_size, ordered=ordered,
+                    validate=validate, connection=connection)
+
+    def get_update_document(self):
+        """returns the update for the changed columns, or None if nothing changed"""
+        dirty = self.get_dirty_columns() - set(['_id'])
+        if not dirty:
+            return None
+
+        set_ = {}
+        unset = {}
+        for k in dirty:
+            v = getattr(self, k)
+            if v is None:
+                unset[k] = ''
+            else:
+                set_[k] = v
+
+        document = {}
+        if set_:
+            document['$set'] = set_
+        if unset:
+            document['$unset'] = unset
+        return document
 
     def update(self):
+        """
+        sends only the columns changed since the instance was loaded or saved,
+        columns set to None are $unset. if nothing changed there is no round trip.
+        """
+        document = self.get_update_document()
+        if not document:
+            return
+
         criteria = {'_id': self._id}
-        obj = {}
-        for k, v in self.__columns__.iteritems():
-            obj[k] = getattr(self, k)
-        obj.pop('_id')
-        self.get_connection()[self.__collection__].update(criteria, {'$set': obj})
+        collection = self.get_connection()[self.__collection__]
+        with events.execute(self.__class__, 'update', criteria=criteria):
+            collection.update(criteria, document)
+        self._clear_dirty()
+        query_cache.invalidate(collection.full_name)
+
+    def get_session(self):
+        """returns the Session this instance belongs to, or None"""
+        return self.__dict__.get('__session__')
 
     def delete(self):
+        session = self.get_session()
+        if session is not None:
+            session.delete(self)
+            return
+
         criteria = {'_id': self._id}
-        self.get_connection()[self.__collection__].remove(criteria)
+        collection = self.get_connection()[self.__collection__]
+        with events.execute(self.__class__, 'delete', criteria=criteria):
+            collection.remove(criteria)
+        query_cache.invalidate(collection.full_name)
 
     def save(self):
         self.validate()
+        session = self.get_session()
+        if session is not None:
+            # written when the session is flushed
+            session.add(self)
+            return
+
         if getattr(self, '_id') and not isinstance(getattr(self, '_id'), Column):
             self.update()
         else:
             self.insert()
 
+def flatten_and(criteria):
+    """
+    merges the parts of an $and into a single document when they don't share any keys,
+    eg: {'$and': [{'a': 1}, {'b': {'$gt': 2}}]} becomes {'a': 1, 'b': {'$gt': 2}}
+    """
+    if len(criteria) != 1 or '$and' not in criteria:
+        return criteria
+
+    parts = []
+    for part in criteria['$and']:
+        part = flatten_and(part)
+        if len(part) == 1 and '$and' in part:
+            parts.extend(part['$and'])
+        else:
+            parts.append(part)
+
+    merged = {}
+    rest = []
+    for part in parts:
+        if any(k in merged for k in part):
+            rest.append(part)
+        else:
+            merged.update(part)
+
+    if not rest:
+        return merged
+    if '$and' in merged:
+        return {'$and': parts}
+    merged['$and'] = rest
+    return merged
+
+def compile_template(value):
+    """
+    returns a function that builds value with the bind parameters replaced, or None if
+    there are no bind parameters in value. only the containers that have parameters in them
+    are copied when the function is called, the rest is shared.
+    """
+    if isinstance(value, BindParam):
+        name = value.name
+
+        def build(params):
+            try:
+                return params[name]
+            except KeyError:
+                raise ValueError('no value given for bind parameter: %s' % name)
+        return build
+
+    if isinstance(value, dict):
+        dynamic = [(k, compile_template(v)) for k, v in value.iteritems()]
+        dynamic = [(k, f) for k, f in dynamic if f is not None]
+        if not dynamic:
+            return None
+        dynamic_keys = set(k for k, f in dynamic)
+        static = dict((k, v) for k, v in value.iteritems() if k not in dynamic_keys)
+
+        def build(params):
+            built = dict(static)
+            for k, f in dynamic:
+                built[k] = f(params)
+            return built
+        return build
+
+    if isinstance(value, list):
+        items = [(v, compile_template(v)) for v in value]
+        if all(f is None for v, f in items):
+            return None
+
+        def build(params):
+            return [v if f is None else f(params) for v, f in items]
+        return build
+
+    return None
+
+
+class CompiledQuery(object):
+    """
+    a query whose criteria is built once and reused, created by Query.compile().
+    executing it only substitutes the values of the bind parameters.
+
+        >>> by_age = User.query.filter(User.age > bindparam('min_age')).sort('age').compile()
+        >>> by_age.all(min_age=10)
+        >>> by_age.execute(min_age=20).limit(5).all()
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.criteria = flatten_and(query.get_criteria())
+        self.build = compile_template(self.criteria)
+
+    def get_criteria(self, **params):
+        if self.build is None:
+            return self.criteria
+        return self.build(params)
+
+    def execute(self, **params):
+        """returns a Query with the parameters bound
+
+        :rtype: Query
+        """
+        query = copy.copy(self.query)
+        # lists and dicts like eager_ and projection_ are changed in place by the query's
+        # methods, every execution gets its own
+        for name, value in vars(query).items():
+            if isinstance(value, (list, dict)):
+                setattr(query, name, copy.copy(value))
+        query.criterias = [self.get_criteria(**params)]
+        return query
+
+    def all(self, **params):
+        return self.execute(**params).all()
+
+    def first(self, **params):
+        return self.execute(**params).first()
+
+    def one(self, **params):
+        return self.execute(**params).one()
+
+    def count(self, **params):
+        return self.execute(**params).count()
+
+STREAM_BATCH_SIZE = 1000
+PARALLEL_BATCH_SIZE = 100
+
 class Query(object):
 
-    def __init__(self, from_, connection=None):
+    def __init__(self, from_, connection=None, session=None):
         self.criterias = []
         self.from_ = from_
+        self.session = session
 
         self.limit_ = None
         self.offset_ = None
         self.sort_ = None
+        self.eager_ = []
+        self.projection_ = None
+        self.deferred_ = None
+        self.batch_size_ = None
+        self.no_cursor_timeout_ = False
+        self.cache_ttl_ = None
+        self.read_preference_ = None
+        self.group_by_ = []
+        # the ExecuteEvent of the running query when there are event listeners
+        self.event_ = None
 
         self.connection  = connection
+        if self.connection is None and session is not None:
+            self.connection = session.connection
         if self.connection is None:
             self.connection = connections.get_default()
 
@@ -494,8 +1264,49 @@ class Query(object):
         return {'$and': compiled}
 
     def get_connection(self):
+        """returns the pymongo collection writes go to"""
         return self.connection.pymongo_connection[self.from_.__collection__]
 
+    def get_reader(self):
+        """
+        returns the pymongo collection reads go to, one of the connection's readers
+        unless the query's session wrote to the collection and pins reads to the writer
+        """
+        collection = self.from_.__collection__
+        if self.session is not None and self.session.is_pinned(collection):
+            return self.get_connection()
+        return self.connection.get_reader(collection, self.read_preference_)
+
+    def using(self, connection):
+        """
+        runs the query on another connection
+
+            >>> User.query.using('analytics').count()
+
+        :param connection: the name of the connection or the Connection itself
+        """
+        if isinstance(connection, basestring):
+            connection = connections.get(connection)
+        self.connection = connection
+        return self
+
+    def read_preference(self, read_preference):
+        """
+        overrides the connection's read preference for this query, eg: 'secondaryPreferred'.
+        'primary' reads from the writer even if the connection has readers.
+        """
+        self.read_preference_ = read_preference
+        return self
+
+    def compile(self):
+        """
+        returns a CompiledQuery, the criteria is built once and can be executed
+        many times with different values for its bind parameters
+
+        :rtype: CompiledQuery
+        """
+        return CompiledQuery(self)
+
     def sort(self, *args):
         t = []
         for arg in args:
@@ -508,8 +1319,124 @@ class Query(object):
         print self.sort_
         return self
 
+    def only(self, *columns):
+        """
+        loads only the given columns, the rest are loaded with one query
+        the first time one of them is read
+
+            >>> User.query.only(User.name, User.age)
+        """
+        names = set(column_name(c) for c in columns)
+        names.add('_id')
+        self.projection_ = dict((name, True) for name in names)
+        self.deferred_ = frozenset(set(self.from_.__columns__) - names)
+        return self
+
+    def defer(self, *columns):
+        """
+        doesn't load the given columns, they are loaded with one query
+        the first time one of them is read
+
+            >>> User.query.defer(User.avatar)
+        """
+        names = set(column_name(c) for c in columns)
+        names.discard('_id')
+        if self.projection_ and self.projection_.get('_id'):
+            # only() was called before
+            for name in names:
+                self.projection_.pop(name, None)
+        else:
+            self.projection_ = self.projection_ or {}
+            for name in names:
+                self.projection_[name] = False
+        self.deferred_ = frozenset((self.deferred_ or frozenset()) | names)
+        return self
+
+    def get_values_documents(self, names):
+        """returns the documents with only names loaded, the query's own projection is left as it is"""
+        projection = dict((name, True) for name in names)
+        if '_id' not in projection:
+            projection['_id'] = False
+        query = copy.copy(self)
+        query.projection_ = projection
+        return query.get_documents()
+
+    def values(self, *columns):
+        """
+        yields a tuple of the values of columns for every document, only these columns
+        are loaded and no model instances are created. missing values are the column's default.
+
+            >>> for name, age in User.query.filter(User.age > 10).values(User.name, User.age):
+            ...     print name, age
+        """
+        names = [column_name(c) for c in columns]
+        defaults = [self.from_.__columns__[name].default_value if name in self.from_.__columns__ else None
+                    for name in names]
+        for document in self.get_values_documents(names):
+            yield tuple([document.get(name, default) for name, default in zip(names, defaults)])
+
+    def scalars(self, column):
+        """
+        yields the value of one column for every document, without creating model instances
+
+            >>> ids = list(User.query.filter_by(role='admin').scalars(User._id))
+        """
+        name = column_name(column)
+        default = self.from_.__columns__[name].default_value if name in self.from_.__columns__ else None
+        for document in self.get_values_documents([name]):
+            yield document.get(name, default)
+
+    def to_columns(self, *columns, **kwargs):
+        """
+        loads columns into numpy arrays, one numpy.ma.MaskedArray per column in an OrderedDict,
+        missing values are masked. no model instances are created.
+
+        dtypes come from the column types: int64 for Integer and BigInteger, float64 for Double,
+        bool for Boolean, datetime64[ms] for Date, 12 byte voids for ObjectId (back with
+        ObjectId(column[i].tobytes())) and object for anything else. needs numpy.
+
+            >>> columns = User.query.filter(User.age > 10).to_columns(User.age, User.score)
+            >>> columns['score'].mean()
+
+        :param size_hint: expected number of results, the arrays start with this size
+            (or the query's limit) and double when they are full
+        """
+        from .columnar import to_columns
+        return to_columns(self, columns, size_hint=kwargs.pop('size_hint', None))
+
+    def as_dicts(self, *columns):
+        """
+        yields the documents as they come from the database, without creating model instances.
+        with columns only these are loaded, otherwise the query's projection is used.
+
+            >>> User.query.as_dicts(User.name, User.age)
+        """
+        if columns:
+            documents = self.get_values_documents([column_name(c) for c in columns])
+        else:
+            documents = self.get_documents()
+        for document in documents:
+            yield document
+
+    def find(self, criteria, projection):
+        """returns a pymongo cursor with the query's cursor options"""
+        # instances are hydrated without going through __init__,
+        # so relationships should be set up before any results are loaded
+        if relationships_reg:
+            configure_models()
+
+        kwargs = {}
+        if self.no_cursor_timeout_:
+            kwargs['no_cursor_timeout'] = True
+        cursor = self.get_reader().find(criteria, projection, **kwargs)
+
+        if self.batch_size_:
+            cursor.batch_size(self.batch_size_)
+
+        return cursor
+
     def get_cursor(self):
-        cursor = self.get_connection().find(self.get_criteria())
+        cursor = self.find(self.get_criteria(), self.projection_)
 
         if self.limit_:
             cursor.limit(self.limit_)
@@ -524,60 +1451,521 @@ class Query(object):
 
     def limit(self, i):
         self.limit_ = i
+        return self
+
+    def offset(self, i):
+        """
+        skips the first i documents. the server still walks through the skipped documents,
+        use paginate_after() for anything but the first few pages
+        """
+        self.offset_ = i
+        return self
+
+    def get_seek_key(self):
+        """returns the (column name, direction) used by paginate_after"""
+        if not self.sort_:
+            return '_id', 1
+        if isinstance(self.sort_[0], (list, tuple)):
+            key, direction = self.sort_[0][0]
+        else:
+            key = self.sort_[0]
+            direction = self.sort_[1] if len(self.sort_) > 1 else 1
+        return column_name(key), direction
+
+    def paginate_after(self, token, per_page):
+        """
+        keyset pagination, every page costs the same no matter how deep it is.
+
+        pages are ordered by _id, or by the first sort() key with _id as a tie breaker.
+        the sort key should be indexed (together with _id) and set on every document.
+        offset() and limit() are ignored.
+
+            >>> page = User.query.sort('age').paginate_after(None, 20)
+            >>> next_page = User.query.sort('age').paginate_after(page.next_token, 20)
+
+        :param token: next_token of the previous page, None for the first page
+        :param per_page: number of instances per page
+        :rtype: Page
+        """
+        key, direction = self.get_seek_key()
+        op = '$gt' if direction == 1 else '$lt'
+
+        criteria = self.get_criteria()
+        if token:
+            last = decode_page_token(token)
+            if last.get('k') != key:
+                raise ValueError('pagination token is not for a query sorted by %s' % key)
+            if key == '_id':
+                seek = {'_id': {op: last['i']}}
+            else:
+                seek = {'$or': [{key: {op: last['v']}},
+                                {key: last['v'], '_id': {op: last['i']}}]}
+            criteria = {'$and': [criteria, seek]} if criteria else seek
+
+        projection = self.projection_
+        if projection and projection.get('_id'):
+            projection = dict(projection, **{key: True})
+        elif projection:
+            projection = dict(projection)
+            projection.pop(key, None)
+
+        sort = [(key, direction)]
+        if key != '_id':
+            sort.append(('_id', direction))
+
+        # we ask for one more document to know if there is a next page
+        cursor = self.find(criteria, projection).sort(sort).limit(per_page + 1)
+        documents = list(self.instrument(cursor, criteria, projection, sort, per_page + 1))
+        next_token = None
+        if len(documents) > per_page:
+            documents = documents[:per_page]
+            last = documents[-1]
+            next_token = encode_page_token({'k': key, 'v': last.get(key), 'i': last['_id']})
+
+        instances = self.load_eager([self.hydrate(d) for d in documents])
+        return Page(instances, next_token)
+
+    def batch_size(self, n):
+        """number of documents the server returns per round trip"""
+        self.batch_size_ = n
+        return self
+
+    def no_cursor_timeout(self, value=True):
+        """
+        keeps the server from closing the cursor after 10 minutes of inactivity,
+        the cursor is closed when iteration finishes or the generator is closed
+        """
+        self.no_cursor_timeout_ = value
+        return self
+
+    def options(self, *options):
+        """
+        query options, eg:
+
+            >>> Project.query.options(eager('user'))
+        """
+        for option in options:
+            if isinstance(option, EagerLoad):
+                self.eager_.append(option)
+            else:
+                raise ValueError('unknown query option: %r' % option)
+        return self
+
+    def load_eager(self, instances):
+        """loads eager relationships for a batch of instances"""
+        for option in self.eager_:
+            option.load(self.from_, instances, self.connection, self.session)
+        return instances
+
+    def cached(self, ttl=30):
+        """
+        caches the results of this query for ttl seconds. queries with the same
+        criteria, sort, limit, offset and projection share the results.
+        see mongomodels.cache.query_cache for the size limit and hit/miss statistics.
+
+            >>> User.query.filter_by(role='admin').cached(ttl=30).all()
+        """
+        self.cache_ttl_ = ttl
+        return self
+
+    def get_cache_source(self):
+        """
+        the connection and read preference of the query, part of its cache keys. databases
+        with the same name on different servers don't share cached results
+        """
+        return self.connection, self.read_preference_ or self.connection.read_preference
+
+    def get_documents(self):
+        """returns the documents matching the query, from the result cache if cached() was used"""
+        self.event_ = None
+        if self.cache_ttl_ is None:
+            return self.instrument(self.get_cursor())
+
+        collection = self.get_connection().full_name
+        key = (collection, self.get_cache_source(), canonicalize(self.get_criteria()),
+               canonicalize(self.sort_), self.limit_, self.offset_, canonicalize(self.projection_))
+        # only cache misses reach the database and are reported to the event listeners
+        return query_cache.get(collection, key, self.cache_ttl_,
+                               lambda: list(self.instrument(self.get_cursor())))
+
+    def instrument(self, documents, criteria=None, projection=None, sort=None, limit=None):
+        """
+        reports the documents read from a cursor to the event listeners, the query's
+        criteria, projection, sort and limit are reported unless given.
+        see mongomodels.events
+        """
+        if not events.enabled:
+            return documents
+        self.event_ = events.ExecuteEvent(self.from_, 'find',
+                                          criteria=self.get_criteria() if criteria is None else criteria,
+                                          projection=projection or self.projection_,
+                                          sort=sort or self.sort_,
+                                          limit=limit or self.limit_,
+                                          cursor=documents)
+        return events.instrument_documents(self.event_, documents)
+
+    def get_pipeline(self):
+        """returns aggregation stages selecting the documents of this query"""
+        pipeline = [{'$match': self.get_criteria()}]
+        sort = get_sort(self.sort_)
+        if sort:
+            pipeline.append({'$sort': SON(sort)})
+        if self.offset_:
+            pipeline.append({'$skip': self.offset_})
+        if self.limit_:
+            pipeline.append({'$limit': self.limit_})
+        return pipeline
+
+    def group_by(self, *columns):
+        """
+        groups the documents by columns for agg(), without group_by agg() returns one row
+        for all the documents
+        """
+        self.group_by_ = list(columns)
+        return self
+
+    def agg(self, **aggregates):
+        """
+        runs the grouping on the server, returns an Aggregation yielding one dict per group
+
+            >>> User.query.filter(User.age > 10).group_by(User.role).agg(
+            ...     count=func.count(), avg_age=func.avg(User.age)).all()
+            [{'role': 'admin', 'count': 3, 'avg_age': 31.5}, ...]
+
+        :rtype: mongomodels.aggregation.Aggregation
+        """
+        return Aggregation(self, self.group_by_, aggregates)
+
+    def explain(self):
+        """
+        returns the server's plan for this query, with the documents and index keys it examined
+
+            >>> User.query.filter_by(name='foo').explain()
+            <Explain FETCH>IXSCAN keys_examined:1 docs_examined:1 returned:1 time:0.0>
+
+        :rtype: mongomodels.explain.Explain
+        """
+        return Explain(self.get_cursor().explain())
 
     def one(self):
         """
         returns the first instance found in collection, raises exception if
         there is more than one instance or if there is no instance found
         """
-        self.limit(2)
-        u = self.get_cursor()
-        u = list(u)
-        assert u, "expected one object"
-        if len(u) > 1:
-            assert u, "expected one object, more than one received"
-        return self.from_(**self.prepare_data(u[0]))
+        # the limit is set on a copy, the query can still be used afterwards
+        query = copy.copy(self).limit(2)
+        documents = iter(query.get_documents())
+        data = next(documents, None)
+        assert data is not None, "expected one object"
+        instance = query.hydrate(data)
+        # reads the rest of the cursor, which also reports the query to the event listeners
+        assert next(documents, None) is None, "expected one object, more than one received"
+        return query.load_eager([instance])[0]
+
+    def hydrate(self, data):
+        """creates a model instance from a document coming from the database"""
+        event = self.event_
+        if event is not None:
+            start = time.time()
+            if self.session is not None:
+                instance = self.session.load(self.from_, data, self.deferred_)
+            else:
+                instance = self.from_._from_document(data, self.connection, self.deferred_)
+            event.hydration_time += time.time() - start
+            events.dispatch('on_hydrate', event, instance)
+            return instance
 
-    def prepare_data(self, data):
-        data['__connection___'] = self.connection
-        return data
+        if self.session is not None:
+            return self.session.load(self.from_, data, self.deferred_)
+        return self.from_._from_document(data, self.connection, self.deferred_)
 
     def first(self):
         """
         returns first instance found in the collection, or None
         """
-        try:
-            data = self.get_cursor()[0]
-            return self.from_(**self.prepare_data(data))
-        except IndexError:
+        query = copy.copy(self).limit(1)
+        documents = iter(query.get_documents())
+        data = next(documents, None)
+        if data is None:
             return None
+        instance = query.hydrate(data)
+        next(documents, None)
+        return query.load_eager([instance])[0]
+
+    def update(self, *updates, **values):
+        """
+        updates all the documents matching the query's criteria with one update_many,
+        limit() and offset() are ignored. takes Update's, dicts of column to value and
+        keyword arguments, plain values are $set and None is $unset.
+
+            >>> User.query.filter(User.age > 10).update({User.role: 'adult'})
+            >>> User.query.filter_by(name='foo').update(User.login_count.inc(1), last_login=now)
+
+        :rtype: pymongo.results.UpdateResult
+        """
+        document = compile_update(updates, values)
+        collection = self.get_connection()
+        criteria = self.get_criteria()
+        with events.execute(self.from_, 'update_many', criteria=criteria) as event:
+            result = collection.update_many(criteria, document)
+            if event is not None:
+                event.documents = result.modified_count
+        query_cache.invalidate(collection.full_name)
+        return result
 
     def delete(self):
-        return self.get_connection().remove(self.get_criteria())
+        collection = self.get_connection()
+        criteria = self.get_criteria()
+        with events.execute(self.from_, 'delete_many', criteria=criteria) as event:
+            result = collection.remove(criteria)
+            if event is not None and result:
+                event.documents = result.get('n', 0)
+        query_cache.invalidate(collection.full_name)
+        return result
+
+    def count(self, limit=None, ttl=None):
+        """
+        counts the documents matching the query's criteria, limit() and offset() are ignored.
 
-    def count(self):
-        return self.get_cursor().count()
+        :param limit: stop counting after this many documents, eg: to check if there are more than
+            100 matches use query.count(limit=101) > 100
+        :param ttl: remember the result for ttl seconds, queries with the same criteria
+            (on any Query instance) return the remembered count until it expires. it's kept
+            in the result cache, writes to the collection drop it like the results of cached()
+        """
+        if ttl:
+            collection = self.get_connection().full_name
+            key = (collection, self.get_cache_source(), 'count', canonicalize(self.get_criteria()), limit)
+            return query_cache.get(collection, key, ttl, lambda: self.count(limit=limit))
+
+        kwargs = {}
+        if limit:
+            kwargs['limit'] = limit
+        criteria = self.get_criteria()
+        with events.execute(self.from_, 'count', criteria=criteria, limit=limit):
+            return self.get_reader().count_documents(criteria, **kwargs)
 
     def __iter__(self):
-        for o in self.get_cursor():
-            yield self.from_(**self.prepare_data(o))
+        if not self.eager_:
+            for o in self.get_documents():
+                yield self.hydrate(o)
+            return
+
+        # with eager loading we hydrate a batch, load the related objects
+        # with one query per relationship and then hand out the batch
+        for batch in self.yield_per(self.batch_size_ or EAGER_BATCH_SIZE):
+            for instance in batch:
+                yield instance
+
+    def yield_per(self, n):
+        """
+        yields lists of n instances, the server returns n documents per round trip
+        unless batch_size() says otherwise. only one batch is kept in memory.
+
+            >>> for users in User.query.yield_per(1000):
+            ...     index(users)
+        """
+        # the batch size is set on a copy, the query keeps its own
+        query = copy.copy(self)
+        if not query.batch_size_:
+            query.batch_size_ = n
+
+        documents = query.get_documents()
+        try:
+            batch = []
+            for o in documents:
+                batch.append(query.hydrate(o))
+                if len(batch) >= n:
+                    yield query.load_eager(batch)
+                    batch = []
+            if batch:
+                yield query.load_eager(batch)
+        finally:
+            close = getattr(documents, 'close', None)
+            if close is not None:
+                close()
+
+    def parallel_iter(self, workers=8, key='_id', ordered=False, partitions=None,
+                      batch_size=PARALLEL_BATCH_SIZE):
+        """
+        scans the query's results with several cursors on worker threads. the range of key is
+        split into partitions (workers * 4 by default) of the same width, each read by one thread.
+
+        with ordered=False instances are yielded as they arrive: instances of the same partition
+        come in key order but partitions are interleaved. with ordered=True instances are yielded
+        in key order, partitions that are read early are kept in memory until it's their turn.
+
+        key should be indexed and hold ObjectId, number or datetime values. documents without key,
+        or where it holds another type, are skipped. limit() and offset() are not supported.
+
+            >>> for user in User.query.filter(User.age > 10).parallel_iter(workers=8):
+            ...     index(user)
+        """
+        return parallel_scan(self, workers, column_name(key), partitions, batch_size, ordered=ordered)
+
+    def parallel_map(self, fn, workers=8, key='_id', ordered=False, partitions=None,
+                     batch_size=PARALLEL_BATCH_SIZE):
+        """
+        like parallel_iter but calls fn(instance) on the worker threads and yields what it returns
+
+            >>> total = sum(User.query.parallel_map(lambda user: user.age))
+        """
+        return parallel_scan(self, workers, column_name(key), partitions, batch_size, fn=fn, ordered=ordered)
+
+    def stream(self, batch_size=STREAM_BATCH_SIZE):
+        """
+        yields instances one by one for scans over big collections, documents are
+        fetched batch_size at a time and the cursor is closed when the generator is
+        closed or garbage collected, even if iteration stops early.
+        """
+        for batch in self.yield_per(batch_size):
+            for instance in batch:
+                yield instance
 
     def all(self):
-        return [self.from_(**v) for v in self.get_cursor()]
+        return list(self)
+
+
+class Page(object):
+    """a page of results returned by Query.paginate_after"""
+
+    def __init__(self, items, next_token):
+        self.items = items
+        self.next_token = next_token
+
+    @property
+    def has_next(self):
+        return self.next_token is not None
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    def __repr__(self):
+        return '<Page items:%s has_next:%s>' % (len(self.items), self.has_next)
+
+def encode_page_token(value):
+    return base64.urlsafe_b64encode(BSON.encode(value))
+
+def decode_page_token(token):
+    try:
+        return BSON(base64.urlsafe_b64decode(str(token))).decode()
+    except Exception:
+        raise ValueError('invalid pagination token: %r' % token)
+
+def canonicalize(value):
+    """
+    returns a hashable version of a query document. the keys of the query and of operator
+    documents are sorted, the same conditions in another order give the same result.
+    embedded documents keep the order of their keys, mongodb only matches them in that order
+    """
+    if isinstance(value, dict):
+        return (dict, tuple(sorted((k, canonicalize_condition(k, v)) for k, v in value.iteritems())))
+    return canonicalize_value(value)
+
+
+def canonicalize_condition(key, value):
+    if key in ('$and', '$or', '$nor'):
+        return (list, tuple(canonicalize(v) for v in value))
+    if key == '$elemMatch':
+        return canonicalize(value)
+    if isinstance(value, dict) and value and all(k.startswith('$') for k in value):
+        return (dict, tuple(sorted((k, canonicalize_condition(k, v)) for k, v in value.iteritems())))
+    return canonicalize_value(value)
+
+
+def canonicalize_value(value):
+    if isinstance(value, dict):
+        return (dict, tuple((k, canonicalize_value(v)) for k, v in value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return (list, tuple(canonicalize_value(v) for v in value))
+    return value
+
+
+EAGER_BATCH_SIZE = 100
+
+class EagerLoad(object):
+    """
+    query option created by eager(), loads a belongs_to parent for a batch of
+    instances with a single $in query
+    """
+    def __init__(self, relationship):
+        self.relationship = relationship
+
+    def get_relationship(self, klass):
+        relationship = self.relationship
+        if isinstance(relationship, basestring):
+            relationship = getattr(klass, relationship, None)
+        if not isinstance(relationship, RelationshipHasOne):
+            raise ValueError('only belongs_to relationships can be eager loaded, %s.%s is not one' %
+                             (klass.__name__, self.relationship))
+        return relationship
+
+    def load(self, klass, instances, connection, session=None):
+        self.get_relationship(klass).load_many(instances, connection, session)
+
+def eager(relationship):
+    """
+    loads a belongs_to relationship with one query per batch of results
+    instead of one query per instance, eg:
+
+        >>> for project in Project.query.options(eager('user')):
+        ...     print project.user
+
+    :param relationship: relationship name or the relationship itself, eg: Project.user
+    :return: EagerLoad
+    """
+    return EagerLoad(relationship)
 
 
 class RelationshipHasOne(object):
     """
     this is used in reverse of belongs_to, RelationshipBelongsTo
     """
-    def __init__(self, klass, other, rel_column):
+    def __init__(self, klass, other, rel_column, name):
         self.klass = klass
         self.other = other
         self.rel_column = rel_column
+        self.name = name
 
     def __get__(self, instance, owner):
-        return RelationshipHasOneQuery(self.other, instance, self.rel_column).\
-            filter({'_id': getattr(instance, self.rel_column)}).first()
+        if instance is None:
+            return self
+
+        rel_id = getattr(instance, self.rel_column)
+        # the loaded parent is cached on the instance as long as
+        # the foreign key doesn't change
+        cached = instance.__dict__.get('__related__', {}).get(self.name)
+        if cached is not None and cached[0] == rel_id:
+            return cached[1]
+
+        if rel_id is None:
+            parent = None
+        else:
+            parent = RelationshipHasOneQuery(self.other, instance, self.rel_column).\
+                filter({'_id': rel_id}).first()
+        self.set_cached(instance, rel_id, parent)
+        return parent
+
+    def set_cached(self, instance, rel_id, parent):
+        instance.__dict__.setdefault('__related__', {})[self.name] = (rel_id, parent)
+
+    def load_many(self, instances, connection=None, session=None):
+        """loads the parents of instances with one query"""
+        ids = set(getattr(instance, self.rel_column) for instance in instances)
+        ids.discard(None)
+        parents = {}
+        if ids:
+            query = Query(from_=self.other, connection=connection, session=session)\
+                .filter({'_id': {'$in': list(ids)}})
+            for parent in query:
+                parents[parent._id] = parent
+
+        for instance in instances:
+            rel_id = getattr(instance, self.rel_column)
+            self.set_cached(instance, rel_id, parents.get(rel_id))
 
 class RelationshipHasAndBelongsTo(object):
     """
@@ -634,11 +2022,11 @@ class RelationshipBelongsTo(object):
 
         setattr(other, prop_name, self)
         self.rel_column = backref_id
-        column = Column(ObjectId)
+        column = Column(ObjectId, index=True)
         column.name = backref_id
         klass.__columns__[backref_id] = column
         setattr(klass, backref_id, column)
-        setattr(klass, backref, RelationshipHasOne(klass, other, backref_id))
+        setattr(klass, backref, RelationshipHasOne(klass, other, backref_id, backref))
         print ">>>", backref
 
 
@@ -671,7 +2059,8 @@ class RelationshipHasOneQuery(Query):
                  owner_instance, rel_column):
         self.owner = owner_instance
         self.rel_column = rel_column
-        super(RelationshipHasOneQuery, self).__init__(from_=from_)
+        super(RelationshipHasOneQuery, self).__init__(from_=from_, connection=owner_instance.__connection__,
+                                                      session=owner_instance.get_session())
 
 
 class RelationshipQuery(Query):
@@ -679,15 +2068,23 @@ class RelationshipQuery(Query):
                  owner_instance, rel_column):
         self.owner = owner_instance
         self.rel_column = rel_column
-        super(RelationshipQuery, self).__init__(from_=from_)
+        super(RelationshipQuery, self).__init__(from_=from_, connection=owner_instance.__connection__,
+                                                session=owner_instance.get_session())
+
+    def join_session(self, instance):
+        # if the owner belongs to a session the related instance is written with it
+        if self.session is not None and instance.get_session() is None:
+            self.session.add(instance)
 
     def add(self, instance):
         self.owner.save()
+        self.join_session(instance)
         setattr(instance, self.rel_column, getattr(self.owner, '_id'))
         instance.save()
 
     def remove(self, instance):
         self.owner.save()
+        self.join_session(instance)
         setattr(instance, self.rel_column, None)
         instance.save()
 
@@ -707,8 +2104,10 @@ class RelationshipQueryThrough(Query):
         self.left_rel_column = left_rel_column
         self.right_rel_column = right_rel_column
         self.through = through
+        self.lookup_ = False
 
-        super(RelationshipQueryThrough, self).__init__(from_=from_)
+        super(RelationshipQueryThrough, self).__init__(from_=from_, connection=owner_instance.__connection__,
+                                                       session=owner_instance.get_session())
 
 
     def add(self, instance):
@@ -725,19 +2124,18 @@ class RelationshipQueryThrough(Query):
         :return: owner instance
         """
         self.owner.save()
+        self.join_session(instance)
         if not instance._id:
             instance.save()
 
-        through_record = self.through.query.filter({
-            self.left_rel_column.name: self.owner._id,
-            self.right_rel_column.name: instance._id
-        }).first()
-
-        if not through_record:
-            through_record = self.through()
-            setattr(through_record, self.right_rel_column.name, self.owner._id)
-            setattr(through_record, self.left_rel_column.name, instance._id)
-            through_record.save()
+        link = self.get_link(instance)
+        if self.session is None:
+            # one round trip, the unique index of generated through collections keeps
+            # concurrent adds from creating the link twice
+            self.through.upsert(link, connection=self.connection)
+        elif self.get_link_record(link) is None:
+            # written with the session's next flush
+            self.session.add(self.through(**link))
 
         setattr(instance, self.left_rel_column.name, getattr(self.owner, '_id'))
         setattr(instance, self.right_rel_column.name, getattr(instance, '_id'))
@@ -747,37 +2145,258 @@ class RelationshipQueryThrough(Query):
 
     def remove(self, instance):
         self.owner.save()
+        self.join_session(instance)
         if not instance._id:
             instance.save()
 
-        through_record = self.through.query.filter({
-            self.left_rel_column.name: instance._id,
-            self.right_rel_column.name: self.owner._id
-        }).first()
-
+        through_record = self.get_link_record(self.get_link(instance))
         if through_record:
             through_record.delete()
 
+    def join_session(self, instance):
+        # if the owner belongs to a session the related instance is written with it
+        if self.session is not None and instance.get_session() is None:
+            self.session.add(instance)
+
+    def get_link(self, instance):
+        return {self.right_rel_column.name: self.owner._id, self.left_rel_column.name: instance._id}
+
+    def get_link_record(self, link):
+        """returns the through instance of link, on the owner's connection and session"""
+        if self.session is not None:
+            # added to the session but not flushed yet
+            for record in self.session.new:
+                if isinstance(record, self.through) and \
+                        all(getattr(record, k) == v for k, v in link.iteritems()):
+                    return record
+        return Query(from_=self.through, connection=self.connection, session=self.session)\
+            .filter(link).first()
+
+    def lookup(self):
+        """
+        resolves the related objects on the server with a $lookup aggregation
+        instead of an $in query per batch of links (needs mongodb >= 3.4)
+        """
+        self.lookup_ = True
+        return self
+
+    def get_through_reader(self):
+        collection = self.through.__collection__
+        if self.session is not None and self.session.is_pinned(collection):
+            return self.connection.pymongo_connection[collection]
+        return self.connection.get_reader(collection, self.read_preference_)
+
+    def get_through_cursor(self):
+        cursor = self.get_through_reader().find(
+            {self.right_rel_column.name: self.owner._id},
+            {self.left_rel_column.name: True},
+            batch_size=THROUGH_BATCH_SIZE)
+        return cursor
+
+    def iter_link_batches(self):
+        """yields the related ids from the link rows, THROUGH_BATCH_SIZE at a time"""
+        left_column = self.left_rel_column.name
+        batch = []
+        for row in self.get_through_cursor():
+            batch.append(row.get(left_column))
+            if len(batch) >= THROUGH_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def resolve_batch(self, ids):
+        """
+        loads the related objects for a batch of link rows with one query,
+        returns them in the order of the link rows
+        """
+        query = Query(from_=self.from_, connection=self.connection, session=self.session)\
+            .filter({'_id': {'$in': ids}})
+        query.read_preference_ = self.read_preference_
+        query.criterias.extend(self.criterias)
+        query.eager_ = self.eager_
+        query.projection_ = self.projection_
+        query.deferred_ = self.deferred_
+        found = {}
+        for instance in query:
+            found[instance._id] = instance
+        return [found[id_] for id_ in ids if id_ in found]
+
+    def iter_lookup(self):
+        pipeline = [
+            {'$match': {self.right_rel_column.name: self.owner._id}},
+            {'$lookup': {'from': self.from_.__collection__,
+                         'localField': self.left_rel_column.name,
+                         'foreignField': '_id',
+                         'as': '__related__'}},
+            {'$unwind': '$__related__'},
+            {'$replaceRoot': {'newRoot': '$__related__'}},
+            {'$match': self.get_criteria()},
+        ]
+        if self.projection_:
+            pipeline.append({'$project': self.projection_})
+        if self.offset_:
+            pipeline.append({'$skip': self.offset_})
+        if self.limit_:
+            pipeline.append({'$limit': self.limit_})
+
+        cursor = self.get_through_reader().aggregate(
+            pipeline, batchSize=THROUGH_BATCH_SIZE)
+        batch = []
+        for o in cursor:
+            batch.append(self.hydrate(o))
+            if len(batch) >= THROUGH_BATCH_SIZE:
+                for instance in self.load_eager(batch):
+                    yield instance
+                batch = []
+        for instance in self.load_eager(batch):
+            yield instance
+
     def __iter__(self):
-        for t in Query(from_=self.through).filter({self.right_rel_column.name: self.owner._id}):
-            left_id = getattr(t, self.left_rel_column.name)
-            yield Query(from_=self.from_).filter({'_id': left_id}).first()
+        """
+        streams the link rows in batches and resolves every batch with a single $in query,
+        filters on the query apply to the related objects. results keep the order of the link rows.
+        """
+        if self.owner._id is None:
+            return
+
+        if relationships_reg:
+            configure_models()
+
+        if self.lookup_:
+            for instance in self.iter_lookup():
+                yield instance
+            return
+
+        # offset and limit apply to the related objects, not to the link rows
+        skipped = yielded = 0
+        for ids in self.iter_link_batches():
+            for instance in self.resolve_batch(ids):
+                if self.offset_ and skipped < self.offset_:
+                    skipped += 1
+                    continue
+                yield instance
+                yielded += 1
+                if self.limit_ and yielded >= self.limit_:
+                    return
 
     def first(self):
         for i in self:
             return i
 
+    def get_documents(self):
+        """
+        the documents of the related objects, one $in query per batch of link rows, in the
+        order of the link rows. used by values(), scalars(), as_dicts() and to_columns()
+        """
+        self.event_ = None
+        if self.owner._id is None:
+            return
+
+        projection = self.projection_
+        drop_id = projection is not None and not projection.get('_id', True)
+        if drop_id:
+            # the _id puts the documents back in the order of the link rows
+            projection = dict(projection, _id=True)
+
+        reader = self.get_reader()
+        skipped = yielded = 0
+        for ids in self.iter_link_batches():
+            found = {}
+            for document in reader.find(self.get_linked_criteria(ids), projection):
+                found[document['_id']] = document
+            for id_ in ids:
+                document = found.get(id_)
+                if document is None:
+                    continue
+                if self.offset_ and skipped < self.offset_:
+                    skipped += 1
+                    continue
+                if drop_id:
+                    del document['_id']
+                yield document
+                yielded += 1
+                if self.limit_ and yielded >= self.limit_:
+                    return
+
+    def yield_per(self, n):
+        """
+        yields lists of n related objects, resolved a batch of link rows at a time like
+        iterating the query. see Query.yield_per()
+        """
+        batch = []
+        for instance in self:
+            batch.append(instance)
+            if len(batch) >= n:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
     def delete(self):
         raise Exception('Not implemented')
 
-    def count(self):
-        return Query(from_=self.through)\
-            .filter({self.right_rel_column.name: self.owner._id}).count()
+    def get_linked_criteria(self, ids):
+        """the query's criteria restricted to a batch of related ids"""
+        return {'$and': [{'_id': {'$in': ids}}] + self.criterias}
+
+    def update(self, *updates, **values):
+        """
+        updates the related objects matching the query, with one update_many per batch
+        of link rows. see Query.update()
+
+            >>> category.products.filter(Product.price > 10).update({Product.on_sale: True})
+
+        :rtype: pymongo.results.UpdateResult
+        """
+        document = compile_update(updates, values)
+        collection = self.get_connection()
+        matched = modified = 0
+        for ids in self.iter_link_batches():
+            criteria = self.get_linked_criteria(ids)
+            with events.execute(self.from_, 'update_many', criteria=criteria) as event:
+                result = collection.update_many(criteria, document)
+                if event is not None:
+                    event.documents = result.modified_count
+            matched += result.matched_count
+            modified += result.modified_count
+        query_cache.invalidate(collection.full_name)
+        return UpdateResult({'n': matched, 'nModified': modified}, True)
+
+    def count(self, limit=None, ttl=None):
+        """
+        counts the related objects matching the query, see Query.count(). with ttl the count
+        is dropped from the cache by writes to the through collection or to the related one
+        """
+        if ttl:
+            db = self.connection.pymongo_connection
+            collections = (db[self.from_.__collection__].full_name, db[self.through.__collection__].full_name)
+            key = (collections, self.get_cache_source(), 'count', self.owner._id,
+                   canonicalize(self.get_criteria()), limit)
+            return query_cache.get(collections, key, ttl, lambda: self.count(limit=limit))
+
+        if not self.criterias:
+            kwargs = {'limit': limit} if limit else {}
+            return self.get_through_reader().count_documents(
+                {self.right_rel_column.name: self.owner._id}, **kwargs)
+
+        # we need to check the far side of the relationship, but we don't need to load it
+        count = 0
+        far_side = self.get_reader()
+        for ids in self.iter_link_batches():
+            kwargs = {'limit': limit - count} if limit else {}
+            count += far_side.count_documents(self.get_linked_criteria(ids), **kwargs)
+            if limit and count >= limit:
+                break
+        return count
 
     def all(self):
         return list(self)
 
 
+THROUGH_BATCH_SIZE = 100
+
+
 if __name__ == "__main__":
 
     import pymongo
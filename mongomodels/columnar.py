@@ -0,0 +1,94 @@
+"""
+columnar results in numpy arrays, used by Query.to_columns
+
+needs numpy (pip install mongomodels[numpy]). values are written straight from the
+documents into typed arrays that grow as needed, no model instances are created.
+"""
+from collections import OrderedDict
+
+try:
+    import numpy
+    import numpy.ma
+except ImportError:
+    raise ImportError('Query.to_columns needs numpy: pip install mongomodels[numpy]')
+
+from .column import Integer, BigInteger, Double, Boolean, Date, ObjectId, column_name
+
+INITIAL_CAPACITY = 1024
+
+# ColumnType -> (numpy dtype, conversion applied before storing a value)
+DTYPES = {
+    Integer: ('int64', None),
+    BigInteger: ('int64', None),
+    Double: ('float64', None),
+    Boolean: ('bool', None),
+    # bson dates have millisecond precision
+    Date: ('datetime64[ms]', None),
+    # raw bytes, a string dtype would strip trailing zero bytes
+    ObjectId: ('V12', lambda oid: oid.binary),
+}
+
+
+def get_dtype(column):
+    """returns the numpy dtype and conversion for a Column, object arrays for types without one"""
+    column_type = getattr(column, '_column_type', None)
+    for klass in type(column_type).__mro__:
+        if klass in DTYPES:
+            dtype, convert = DTYPES[klass]
+            return numpy.dtype(dtype), convert
+    return numpy.dtype(object), None
+
+
+class ColumnBuffer(object):
+    """a typed array with a mask of missing values, doubles its size when it's full"""
+
+    def __init__(self, name, dtype, convert=None, capacity=INITIAL_CAPACITY):
+        self.name = name
+        self.convert = convert
+        self.values = numpy.zeros(capacity, dtype)
+        self.mask = numpy.zeros(capacity, bool)
+
+    def grow(self, capacity):
+        values = numpy.zeros(capacity, self.values.dtype)
+        values[:len(self.values)] = self.values
+        mask = numpy.zeros(capacity, bool)
+        mask[:len(self.mask)] = self.mask
+        self.values, self.mask = values, mask
+
+    def set(self, i, value):
+        if value is None:
+            self.mask[i] = True
+            return
+        if self.convert is not None:
+            value = self.convert(value)
+        try:
+            self.values[i] = value
+        except (TypeError, ValueError):
+            raise ValueError('%r in column %s can not be stored as %s' % (value, self.name, self.values.dtype))
+
+    def get_array(self, size):
+        return numpy.ma.MaskedArray(self.values[:size], mask=self.mask[:size])
+
+
+def to_columns(query, columns, size_hint=None):
+    """returns an OrderedDict of column name to numpy.ma.MaskedArray, see Query.to_columns"""
+    capacity = size_hint or query.limit_ or INITIAL_CAPACITY
+    buffers = []
+    for column in columns:
+        name = column_name(column)
+        if not hasattr(column, '_column_type'):
+            column = query.from_.__columns__.get(name)
+        dtype, convert = get_dtype(column)
+        buffers.append(ColumnBuffer(name, dtype, convert, capacity))
+
+    size = 0
+    for document in query.get_values_documents([b.name for b in buffers]):
+        if size == capacity:
+            capacity *= 2
+            for b in buffers:
+                b.grow(capacity)
+        for b in buffers:
+            b.set(size, document.get(b.name))
+        size += 1
+
+    return OrderedDict((b.name, b.get_array(size)) for b in buffers)
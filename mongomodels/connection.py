@@ -1,13 +1,65 @@
+from pymongo import ReadPreference
+
+READ_PREFERENCES = {
+    'primary': ReadPreference.PRIMARY,
+    'primaryPreferred': ReadPreference.PRIMARY_PREFERRED,
+    'secondary': ReadPreference.SECONDARY,
+    'secondaryPreferred': ReadPreference.SECONDARY_PREFERRED,
+    'nearest': ReadPreference.NEAREST,
+}
+
 class Connection(object):
     """
     just a simple wrapper around pymongo connection
+
+    writes always go to pymongo_connection. queries read from the readers if
+    there are any, otherwise from pymongo_connection.
     """
-    def __init__(self, pymongo_connection):
+    def __init__(self, pymongo_connection, readers=None, read_preference=None):
+        """
+
+        :param pymongo_connection: database writes go to
+        :param readers: databases queries read from, eg: on a dedicated analytics node
+        :param read_preference: default read preference of queries, eg: secondaryPreferred
+        """
         self.pymongo_connection = pymongo_connection
+        self.readers = list(readers or [])
+        self.read_preference = read_preference
+        self._next_reader = 0
 
     def query(self, model_class):
         return model_class.query_from_connection(self)
 
+    def session(self, read_your_writes=False):
+        """
+        :rtype: Session
+        """
+        from .session import Session
+        return Session(self, read_your_writes=read_your_writes)
+
+    def add_reader(self, pymongo_connection):
+        self.readers.append(pymongo_connection)
+        return self
+
+    def get_reader(self, collection, read_preference=None):
+        """
+        returns the pymongo collection queries read from. readers are used in turns,
+        a 'primary' read preference sends the query to the writer.
+        """
+        read_preference = read_preference or self.read_preference
+        if read_preference == 'primary' or not self.readers:
+            database = self.pymongo_connection
+        else:
+            self._next_reader = (self._next_reader + 1) % len(self.readers)
+            database = self.readers[self._next_reader]
+
+        collection = database[collection]
+        if read_preference:
+            if read_preference not in READ_PREFERENCES:
+                raise ValueError('unknown read preference: %s' % read_preference)
+            collection = collection.with_options(read_preference=READ_PREFERENCES[read_preference])
+        return collection
+
 
 class Connections(object):
 
@@ -16,18 +68,42 @@ class Connections(object):
     def get_default(self):
         return self._connections.get('default', None)
 
-    def add_(self, name, pymongo_connection):
-        self._connections[name] = Connection(pymongo_connection)
+    def get(self, name):
+        """
+        :rtype: Connection
+        """
+        try:
+            return self._connections[name]
+        except KeyError:
+            raise KeyError('no connection named %s' % name)
+
+    def add_(self, name, pymongo_connection, readers=None, read_preference=None):
+        self._connections[name] = Connection(pymongo_connection, readers=readers,
+                                             read_preference=read_preference)
         return self._connections[name]
 
-    def add(self, *args):
+    def add(self, *args, **kwargs):
         """
+        connections.add(db) adds the default connection, connections.add('analytics', db)
+        a named one. readers and read_preference are passed to Connection.
 
         :param args:
         :rtype: Connection
         :return:
         """
         if len(args) == 1:
-            return self.add_('default', args[0])
+            return self.add_('default', args[0], **kwargs)
+        else:
+            return self.add_(*args, **kwargs)
+
+    def add_reader(self, *args):
+        """
+        adds a database to read from to the default connection, or to a named one
+        with connections.add_reader('analytics', db)
+
+        :rtype: Connection
+        """
+        if len(args) == 1:
+            return self.get_default().add_reader(args[0])
         else:
-            return self.add_(*args)
+            return self.get(args[0]).add_reader(args[1])
@@ -0,0 +1,152 @@
+"""
+streaming dumps and loads of a model's collection, see MongoModel.dump and MongoModel.load
+
+files are read and written one document at a time and inserted one batch at a time,
+memory use doesn't depend on the size of the file. bson files are memory mapped and
+every document is decoded from a buffer over the map, without copying it first.
+"""
+import copy
+import itertools
+import mmap
+import os
+import struct
+
+import bson
+from bson import BSON, json_util
+
+from .base import connections
+from .column import ValidationError, STREAM_BATCH_SIZE
+
+FORMATS = ('bson', 'jsonl')
+
+
+class LoadResult(object):
+    """
+    returned from MongoModel.load
+
+    inserted is the number of documents inserted, errors is a list of (document, error)
+    tuples, error is either a ValidationError or the write error document returned by the server
+    """
+    def __init__(self):
+        self.inserted = 0
+        self.errors = []
+
+    def __repr__(self):
+        return '<LoadResult inserted:%s errors:%s>' % (self.inserted, len(self.errors))
+
+
+def get_format(path, format):
+    if format is None:
+        format = 'jsonl' if os.path.splitext(path)[1] in ('.jsonl', '.json') else 'bson'
+    if format not in FORMATS:
+        raise ValueError('unknown format %r, expected one of %s' % (format, ', '.join(FORMATS)))
+    return format
+
+
+def dump(model, path, query=None, format=None):
+    """writes the documents of query to path, returns how many were written"""
+    format = get_format(path, format)
+    if query is None:
+        query = model.query
+    if not query.batch_size_:
+        # on a copy, the query passed in keeps its options
+        query = copy.copy(query).batch_size(STREAM_BATCH_SIZE)
+
+    count = 0
+    with open(path, 'wb') as f:
+        for document in query.as_dicts():
+            if format == 'bson':
+                f.write(BSON.encode(document))
+            else:
+                f.write(json_util.dumps(document))
+                f.write('\n')
+            count += 1
+    return count
+
+
+def iter_bson(path):
+    """yields the documents of a bson file"""
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            offset = 0
+            size = len(mm)
+            while offset < size:
+                # every document starts with its length, an int32 counting the length itself
+                length = 0
+                if offset + 4 <= size:
+                    length = struct.unpack_from('<i', mm, offset)[0]
+                if length < 5 or offset + length > size:
+                    raise ValueError('%s is truncated or not a bson file, at byte %s' % (path, offset))
+                yield bson.decode(buffer(mm, offset, length))
+                offset += length
+        finally:
+            mm.close()
+
+
+def iter_jsonl(path):
+    """yields the documents of a file with one extended json document per line"""
+    with open(path, 'rb') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield json_util.loads(line)
+
+
+def validate_batch(model, documents, connection, ordered):
+    """returns the valid documents and a list of (document, ValidationError) for the rest"""
+    valid = []
+    invalid = []
+    for document in documents:
+        try:
+            model._from_document(document, connection).validate()
+        except ValidationError as e:
+            invalid.append((document, e))
+            if ordered:
+                break
+            continue
+        valid.append(document)
+    return valid, invalid
+
+
+def load(model, path, format=None, batch_size=1000, ordered=False, validate=True, connection=None):
+    """inserts the documents of path in batches, see MongoModel.load"""
+    if get_format(path, format) == 'bson':
+        documents = iter_bson(path)
+    else:
+        documents = iter_jsonl(path)
+
+    connection = connection or connections.get_default()
+    collection = connection.pymongo_connection[model.__collection__]
+    result = LoadResult()
+
+    try:
+        while True:
+            batch = list(itertools.islice(documents, batch_size))
+            if not batch:
+                break
+
+            invalid = []
+            if validate:
+                batch, invalid = validate_batch(model, batch, connection, ordered)
+                result.errors.extend(invalid)
+
+            failed = {}
+            if batch:
+                failed = model._send_batch(collection, batch, ordered)
+                result.errors.extend((batch[i], failed[i]) for i in sorted(failed))
+                if ordered and failed:
+                    # mongodb stops at the first error
+                    result.inserted += min(failed)
+                else:
+                    result.inserted += len(batch) - len(failed)
+
+            if ordered and (invalid or failed):
+                break
+    finally:
+        # unmaps the file when we stop early
+        documents.close()
+
+    return result
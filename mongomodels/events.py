@@ -0,0 +1,230 @@
+"""
+instrumentation hooks
+
+    from mongomodels import events
+
+    def log_query(event):
+        print event.model.__name__, event.operation, event.criteria, event.elapsed
+
+    events.listen('after_execute', log_query)
+
+listeners get an ExecuteEvent. before_execute is called before the operation is sent,
+after_execute when it's done (for queries, when the cursor is exhausted or closed), and
+on_hydrate after each instance is created from a document, with the instance as
+second argument.
+
+listeners are called on the thread running the operation, an exception raised in a
+listener propagates to the caller.
+"""
+from contextlib import contextmanager
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('before_execute', 'after_execute', 'on_hydrate')
+
+_listeners = dict((name, []) for name in EVENTS)
+
+# checked before building any events, so instrumentation costs nothing without listeners
+enabled = False
+
+
+def listen(name, fn):
+    """registers fn to be called on the event name"""
+    global enabled
+    if name not in _listeners:
+        raise ValueError('unknown event: %s, expected one of %s' % (name, ', '.join(EVENTS)))
+    _listeners[name].append(fn)
+    enabled = True
+    return fn
+
+
+def remove(name, fn):
+    global enabled
+    _listeners[name].remove(fn)
+    enabled = any(_listeners.values())
+
+
+class ExecuteEvent(object):
+    """
+    describes one operation sent to the database
+
+    operation is one of find, count, insert, insert_many, update, update_many, upsert, delete, delete_many,
+    bulk_write or aggregate. elapsed is the time spent waiting for the database in seconds,
+    hydration_time the time spent creating instances from the documents.
+    documents is the number of documents returned, or written for write operations.
+    cursor is the pymongo cursor for reads, before_execute listeners can explain() it.
+    """
+
+    def __init__(self, model, operation, criteria=None, projection=None, sort=None, limit=None, cursor=None):
+        self.model = model
+        self.operation = operation
+        self.criteria = criteria
+        self.projection = projection
+        self.sort = sort
+        self.limit = limit
+        self.cursor = cursor
+        self.elapsed = 0.0
+        self.hydration_time = 0.0
+        self.documents = 0
+        self.error = None
+
+    def get_shape(self):
+        """the criteria and sort with the values left out, queries with the same shape use the same plan"""
+        return '%s %s %s sort:%s' % (self.model.__name__, self.operation,
+                                     query_shape(self.criteria), query_shape(self.sort, keep_values=True))
+
+    def __repr__(self):
+        return '<ExecuteEvent %s %s elapsed:%.4f documents:%s>' % (
+            self.model.__name__, self.operation, self.elapsed, self.documents)
+
+
+def query_shape(value, keep_values=False):
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s: %s' % (k, query_shape(value[k], keep_values)) for k in sorted(value))
+    if isinstance(value, (list, tuple)) and (keep_values or any(isinstance(v, dict) for v in value)):
+        return '[%s]' % ', '.join(query_shape(v, keep_values) for v in value)
+    if keep_values or value is None:
+        return repr(value)
+    return '?'
+
+
+def dispatch(name, *args):
+    for fn in _listeners[name]:
+        fn(*args)
+
+
+@contextmanager
+def execute(model, operation, **kwargs):
+    """
+    wraps a single operation, yields the ExecuteEvent (None if there are no listeners)
+
+        with events.execute(User, 'count', criteria=criteria) as event:
+            ...
+    """
+    if not enabled:
+        yield None
+        return
+
+    event = ExecuteEvent(model, operation, **kwargs)
+    dispatch('before_execute', event)
+    start = time.time()
+    try:
+        yield event
+    except Exception as e:
+        event.error = e
+        raise
+    finally:
+        event.elapsed = time.time() - start
+        dispatch('after_execute', event)
+
+
+def instrument_documents(event, documents):
+    """
+    wraps a cursor, only the time spent fetching documents from the cursor counts as
+    elapsed time. after_execute is called when the cursor is exhausted or closed.
+    """
+    dispatch('before_execute', event)
+    iterator = iter(documents)
+    try:
+        while True:
+            start = time.time()
+            try:
+                document = next(iterator)
+            except StopIteration:
+                return
+            except Exception as e:
+                event.error = e
+                raise
+            finally:
+                event.elapsed += time.time() - start
+            event.documents += 1
+            yield document
+    finally:
+        close = getattr(documents, 'close', None)
+        if close is not None:
+            close()
+        dispatch('after_execute', event)
+
+
+class SlowQueryLogger(object):
+    """
+    logs operations slower than threshold seconds
+
+        >>> events.listen('after_execute', SlowQueryLogger(threshold=0.1))
+    """
+
+    def __init__(self, threshold=0.1, logger=logger, level=logging.WARNING):
+        self.threshold = threshold
+        self.logger = logger
+        self.level = level
+
+    def __call__(self, event):
+        if event.elapsed >= self.threshold:
+            self.logger.log(self.level, 'slow query: %.1fms %s.%s criteria:%s projection:%s sort:%s limit:%s '
+                                        'documents:%s hydration:%.1fms',
+                            event.elapsed * 1000, event.model.__name__, event.operation, event.criteria,
+                            event.projection, event.sort, event.limit, event.documents,
+                            event.hydration_time * 1000)
+
+
+class QueryStats(object):
+    """
+    aggregates operations per query shape
+
+        >>> stats = events.listen('after_execute', QueryStats())
+        >>> stats.snapshot()
+        [{'shape': "User find {age: {$gt: ?}} sort:None", 'count': 120, 'p50': 0.0012, ...}]
+
+    latencies are kept for the last max_samples operations of every shape. documents is the
+    number of documents returned, use Query.explain() to see how many the server examined.
+    """
+
+    def __init__(self, max_samples=1000):
+        self.max_samples = max_samples
+        self.shapes = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        shape = event.get_shape()
+        with self.lock:
+            stats = self.shapes.get(shape)
+            if stats is None:
+                stats = self.shapes[shape] = {'count': 0, 'errors': 0, 'documents': 0,
+                                              'hydration_time': 0.0, 'samples': []}
+            stats['count'] += 1
+            stats['documents'] += event.documents
+            stats['hydration_time'] += event.hydration_time
+            if event.error is not None:
+                stats['errors'] += 1
+            stats['samples'].append(event.elapsed)
+            if len(stats['samples']) > self.max_samples:
+                stats['samples'].pop(0)
+
+    def snapshot(self):
+        """returns the statistics of every shape, slowest p99 first"""
+        result = []
+        with self.lock:
+            for shape, stats in self.shapes.iteritems():
+                samples = sorted(stats['samples'])
+                result.append({'shape': shape,
+                               'count': stats['count'],
+                               'errors': stats['errors'],
+                               'documents': stats['documents'],
+                               'hydration_time': stats['hydration_time'],
+                               'p50': percentile(samples, 50),
+                               'p99': percentile(samples, 99)})
+        return sorted(result, key=lambda s: s['p99'], reverse=True)
+
+    def reset(self):
+        with self.lock:
+            self.shapes = {}
+
+
+def percentile(sorted_samples, p):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(p / 100.0 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
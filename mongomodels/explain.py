@@ -0,0 +1,127 @@
+"""
+query plans, used by Query.explain() and PlanChecker
+
+PlanChecker explains every query shape once and complains about collection scans and
+queries that examine many more documents than they return. it's meant for development
+and CI against a local mongod, explaining runs the query a second time.
+
+    from mongomodels import events
+    from mongomodels.explain import PlanChecker
+
+    events.listen('before_execute', PlanChecker(max_ratio=10, action='raise'))
+"""
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class QueryPlanError(Exception):
+    pass
+
+
+class Explain(object):
+    """
+    the interesting parts of an explain result, raw is the whole document returned by the server
+
+    stages are the stage names of the winning plan, outermost first, eg: ['FETCH', 'IXSCAN'].
+    time is the server's execution time in seconds.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+        planner = raw.get('queryPlanner', {})
+        self.winning_plan = planner.get('winningPlan', {})
+        self.stages = plan_stages(self.winning_plan)
+
+        stats = raw.get('executionStats', {})
+        self.keys_examined = stats.get('totalKeysExamined')
+        self.docs_examined = stats.get('totalDocsExamined')
+        self.returned = stats.get('nReturned')
+        millis = stats.get('executionTimeMillis')
+        self.time = millis / 1000.0 if millis is not None else None
+
+    @property
+    def is_collscan(self):
+        return 'COLLSCAN' in self.stages
+
+    def get_ratio(self):
+        """documents examined per document returned"""
+        if self.docs_examined is None:
+            return None
+        return float(self.docs_examined) / max(self.returned or 0, 1)
+
+    def __repr__(self):
+        return '<Explain %s keys_examined:%s docs_examined:%s returned:%s time:%s>' % (
+            '>'.join(self.stages), self.keys_examined, self.docs_examined, self.returned, self.time)
+
+
+def plan_stages(plan):
+    """returns the stage names in a plan, depth first"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        # inputStage, inputStages, queryPlan on 5.0+, shards on mongos
+        for k, v in plan.iteritems():
+            if isinstance(v, (dict, list)):
+                stages.extend(plan_stages(v))
+    elif isinstance(plan, list):
+        for p in plan:
+            stages.extend(plan_stages(p))
+    return stages
+
+
+class PlanChecker(object):
+    """
+    a before_execute listener explaining the first query of every shape
+
+    a query is reported if its winning plan scans the collection (queries without
+    criteria or sort are allowed to) or if it examines more than max_ratio documents
+    per document returned.
+
+    :param max_ratio: documents examined per document returned
+    :param action: 'warn' logs the problem, 'raise' raises QueryPlanError before the query runs
+    """
+
+    def __init__(self, max_ratio=10, action='warn', logger=logger):
+        if action not in ('warn', 'raise'):
+            raise ValueError('action should be warn or raise, not %r' % action)
+        self.max_ratio = max_ratio
+        self.action = action
+        self.logger = logger
+        self.seen = set()
+        self.lock = threading.Lock()
+
+    def __call__(self, event):
+        if getattr(event, 'cursor', None) is None:
+            return
+
+        shape = event.get_shape()
+        with self.lock:
+            if shape in self.seen:
+                return
+            self.seen.add(shape)
+
+        problem = self.check(event, Explain(event.cursor.explain()))
+        if problem is None:
+            return
+        if self.action == 'raise':
+            # explained again next time, until it's fixed
+            with self.lock:
+                self.seen.discard(shape)
+            raise QueryPlanError(problem)
+        self.logger.warning(problem)
+
+    def check(self, event, explain):
+        """returns a description of what's wrong with the plan, or None"""
+        if explain.is_collscan and (event.criteria or event.sort):
+            return 'collection scan: %s criteria:%s sort:%s, %r' % (
+                event.model.__name__, event.criteria, event.sort, explain)
+
+        ratio = explain.get_ratio()
+        if ratio is not None and ratio > self.max_ratio:
+            return '%s examined %s documents for %s returned: criteria:%s sort:%s, %r' % (
+                event.model.__name__, explain.docs_examined, explain.returned,
+                event.criteria, event.sort, explain)
+        return None
@@ -0,0 +1,169 @@
+"""
+parallel scans, used by Query.parallel_iter and Query.parallel_map
+
+the range of an indexed key (_id by default) is split into partitions, every
+partition is read with its own cursor on a worker thread.
+"""
+from Queue import Queue, Empty
+import datetime
+import threading
+
+from bson.objectid import ObjectId as ObjectId_
+
+from . import events
+
+_done = object()
+
+
+def split_range(low, high, n):
+    """
+    returns up to n - 1 boundaries splitting [low, high] in n ranges of the same width,
+    works for ObjectId's, numbers and datetimes
+    """
+    if isinstance(low, ObjectId_):
+        bounds = split_range(int(str(low), 16), int(str(high), 16), n)
+        return [ObjectId_('%024x' % b) for b in bounds]
+
+    if isinstance(low, datetime.datetime):
+        seconds = (high - low).total_seconds()
+        return [low + datetime.timedelta(seconds=seconds * i / n) for i in range(1, n)]
+
+    if isinstance(low, (int, long, float)):
+        bounds = []
+        for i in range(1, n):
+            if isinstance(low, float) or isinstance(high, float):
+                b = low + (high - low) * float(i) / n
+            else:
+                b = low + (high - low) * i // n
+            if b > low and (not bounds or b > bounds[-1]):
+                bounds.append(b)
+        return bounds
+
+    raise ValueError('can not split a range of %s values, use a key with ObjectId, '
+                     'number or datetime values' % type(low).__name__)
+
+
+def get_partitions(query, key, n):
+    """
+    returns a list of criterias, one per partition, ordered by key. documents without
+    the key, or with a value of another type than the lowest one, are left out
+    """
+    collection = query.get_reader()
+    criteria = query.get_criteria()
+
+    def key_criteria(r):
+        if criteria:
+            return {'$and': [criteria, {key: r}]}
+        return {key: r}
+
+    first = list(collection.find(key_criteria({'$ne': None}), {key: True}).sort(key, 1).limit(1))
+    if not first:
+        return []
+    low = first[0][key]
+    # comparisons only match values of the same type, $gte low skips strings after numbers etc.
+    last = list(collection.find(key_criteria({'$gte': low}), {key: True}).sort(key, -1).limit(1))
+
+    bounds = split_range(low, last[0][key], n)
+    if not bounds:
+        return [key_criteria({'$gte': low})]
+
+    ranges = [{'$gte': low, '$lt': bounds[0]}]
+    for b_low, b_high in zip(bounds, bounds[1:]):
+        ranges.append({'$gte': b_low, '$lt': b_high})
+    ranges.append({'$gte': bounds[-1]})
+
+    return [key_criteria(r) for r in ranges]
+
+
+def parallel_scan(query, workers, key, partitions, batch_size, fn=None, ordered=False):
+    """
+    yields the instances of query (or fn(instance) if fn is given) read by workers threads.
+
+    with ordered=False results are yielded as they arrive, instances of the same partition
+    come in key order but partitions are interleaved. with ordered=True the results come
+    in key order, partitions that finish early are buffered until it's their turn.
+    """
+    if query.limit_ or query.offset_:
+        raise ValueError('limit and offset are not supported in parallel scans')
+
+    criterias = get_partitions(query, key, partitions or workers * 4)
+    work = Queue()
+    for i, criteria in enumerate(criterias):
+        work.put((i, criteria))
+    results = Queue(maxsize=workers * 2)
+    stop = threading.Event()
+
+    def worker():
+        while not stop.is_set():
+            try:
+                i, criteria = work.get_nowait()
+            except Empty:
+                return
+            try:
+                cursor = query.find(criteria, query.projection_).sort(key, 1).batch_size(batch_size)
+                documents = cursor
+                if events.enabled:
+                    # one event per partition, hydration isn't timed on the workers
+                    event = events.ExecuteEvent(query.from_, 'find', criteria=criteria,
+                                                projection=query.projection_, sort=[(key, 1)],
+                                                cursor=cursor)
+                    documents = events.instrument_documents(event, cursor)
+                batch = []
+                for document in documents:
+                    batch.append(query.hydrate(document))
+                    if len(batch) >= batch_size:
+                        results.put((i, _process(query, batch, fn)))
+                        batch = []
+                        if stop.is_set():
+                            cursor.close()
+                            return
+                if batch:
+                    results.put((i, _process(query, batch, fn)))
+                results.put((i, _done))
+            except Exception as e:
+                results.put((i, e))
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(criterias)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    try:
+        buffered = {}
+        finished = set()
+        current = 0
+        while len(finished) < len(criterias):
+            i, batch = results.get()
+            if isinstance(batch, Exception):
+                raise batch
+
+            if batch is _done:
+                finished.add(i)
+            elif ordered and i != current:
+                buffered.setdefault(i, []).append(batch)
+            else:
+                for item in batch:
+                    yield item
+
+            if ordered:
+                # move on to the next partition, handing out what it buffered so far
+                while current in finished:
+                    current += 1
+                    for b in buffered.pop(current, []):
+                        for item in b:
+                            yield item
+    finally:
+        stop.set()
+        # let the workers blocked on a full queue exit
+        while any(t.is_alive() for t in threads):
+            try:
+                results.get(timeout=0.1)
+            except Empty:
+                pass
+
+
+def _process(query, batch, fn):
+    batch = query.load_eager(batch)
+    if fn is None:
+        return batch
+    return [fn(instance) for instance in batch]
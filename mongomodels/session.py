@@ -0,0 +1,172 @@
+from bson.objectid import ObjectId as ObjectId_
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from .base import connections
+from .cache import query_cache
+from . import events
+
+
+class Session(object):
+    """
+    a unit of work tied to a connection.
+
+    instances loaded through a session are kept in an identity map, loading the same
+    document twice returns the same instance. save() and delete() on instances that belong
+    to a session don't write anything, the changes are sent with one bulk_write per collection
+    when the session is flushed.
+
+        >>> session = Session()
+        >>> user = session.get_by_id(User, user_id)
+        >>> user.age = 12
+        >>> user.save()
+        >>> session.add(User(name='foo'))
+        >>> session.commit()
+
+    it can be used as a context manager, changes are committed if there is no exception
+    and rolled back otherwise
+
+        >>> with Session() as session:
+        ...     session.add(user)
+
+    new instances get their _id when they are added to the session, so they can be used
+    in relationships before the session is flushed.
+
+    with read_your_writes=True, queries of the session read from the connection's writer
+    instead of its readers once the session wrote to their collection.
+    """
+
+    def __init__(self, connection=None, read_your_writes=False):
+        self.connection = connection or connections.get_default()
+        self.read_your_writes = read_your_writes
+        self.identity_map = {}
+        self.new = []
+        self.deleted = []
+        self.written = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+            self.close()
+        else:
+            self.rollback()
+
+    def query(self, model_class):
+        """returns a query whose results go through the identity map
+
+        :rtype: Query
+        """
+        from .column import Query
+        return Query(from_=model_class, connection=self.connection, session=self)
+
+    def get_by_id(self, model_class, object_id):
+        """returns the instance from the identity map or loads it"""
+        object_id = ObjectId_(object_id)
+        instance = self.identity_map.get((model_class, object_id))
+        if instance is not None:
+            return instance
+        return self.query(model_class).filter({'_id': object_id}).first()
+
+    def load(self, model_class, document, deferred=None):
+        """hydrates a document coming from the database, unless it's already in the identity map"""
+        key = (model_class, document.get('_id'))
+        instance = self.identity_map.get(key)
+        if instance is None:
+            instance = model_class._from_document(document, self.connection, deferred)
+            instance.__session__ = self
+            self.identity_map[key] = instance
+        return instance
+
+    def add(self, instance):
+        """adds an instance to the session, it's inserted or updated on the next flush"""
+        instance.__connection__ = self.connection
+        instance.__session__ = self
+        if instance._id is None:
+            instance._id = ObjectId_()
+            self.new.append(instance)
+        self.identity_map[(instance.__class__, instance._id)] = instance
+        return instance
+
+    def delete(self, instance):
+        """the instance is deleted on the next flush"""
+        if instance in self.new:
+            self.new.remove(instance)
+        elif instance not in self.deleted:
+            self.deleted.append(instance)
+        self.identity_map.pop((instance.__class__, instance._id), None)
+
+    def get_dirty(self):
+        """returns the instances that will be updated on the next flush"""
+        return [instance for instance in self.identity_map.itervalues()
+                if instance.get_dirty_columns() and instance not in self.new]
+
+    def flush(self):
+        """
+        sends all pending changes with one bulk_write per collection, new and changed
+        instances are validated first and a ValidationError is raised before anything is sent
+        """
+        requests = {}
+        models = {}
+        flushed = []
+
+        def add_request(instance, request):
+            requests.setdefault(instance.__collection__, []).append(request)
+            models[instance.__collection__] = instance.__class__
+            flushed.append(instance)
+
+        dirty = self.get_dirty()
+        # nothing is sent if one of the instances is invalid
+        for instance in self.new + dirty:
+            instance.validate()
+
+        for instance in self.new:
+            add_request(instance, InsertOne(instance.as_document()))
+
+        for instance in dirty:
+            document = instance.get_update_document()
+            if document:
+                # an _id assigned before the instance was ever saved, it's not in the database yet
+                upsert = '_id' in instance.__dirty__
+                add_request(instance, UpdateOne({'_id': instance._id}, document, upsert=upsert))
+
+        for instance in self.deleted:
+            add_request(instance, DeleteOne({'_id': instance._id}))
+
+        db = self.connection.pymongo_connection
+        for collection, collection_requests in requests.iteritems():
+            with events.execute(models[collection], 'bulk_write') as event:
+                db[collection].bulk_write(collection_requests, ordered=True)
+                if event is not None:
+                    event.documents = len(collection_requests)
+            self.written.add(collection)
+            query_cache.invalidate(db[collection].full_name)
+
+        for instance in flushed:
+            instance._clear_dirty()
+        for instance in self.deleted:
+            instance.__session__ = None
+
+        self.new = []
+        self.deleted = []
+
+    def is_pinned(self, collection):
+        """checks if queries on collection should read from the writer"""
+        return self.read_your_writes and collection in self.written
+
+    def commit(self):
+        self.flush()
+
+    def rollback(self):
+        """forgets the pending changes, instances in the identity map keep their values"""
+        for instance in self.new:
+            instance._id = None
+        self.new = []
+        self.deleted = []
+        self.close()
+
+    def close(self):
+        """detaches all instances from the session"""
+        for instance in self.identity_map.itervalues():
+            instance.__session__ = None
+        self.identity_map = {}
@@ -15,6 +15,10 @@ setup(
     author_email='aybars.badur@gmail.com',
     packages=['mongomodels'],
     install_requires=['pymongo', 'inflection'],
+    extras_require={
+        'async': ['tornado', 'motor'],
+        'numpy': ['numpy'],
+    },
     classifiers = [
         'Development Status :: 4 - Beta',
         'Intended Audience :: Developers',
@@ -0,0 +1,49 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column, func
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    role = Column(String)
+    team = Column(String)
+    age = Column(Integer)
+
+class TestAggregation(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.users.remove()
+
+        for i, (role, team) in enumerate([('admin', 'a'), ('admin', 'b'), ('admin', 'a'),
+                                          ('user', 'a'), ('user', 'b')]):
+            User(name='user%s' % i, role=role, team=team, age=10 + i * 5).save()
+
+    def test_pipeline(self):
+        agg = User.query.filter(User.age > 10).group_by(User.role).agg(
+            count=func.count(), avg_age=func.avg(User.age)).sort('count', -1).limit(5)
+        assert agg.get_pipeline() == [
+            {'$match': {'age': {'$gt': 10}}},
+            {'$group': {'_id': '$role', 'count': {'$sum': 1}, 'avg_age': {'$avg': '$age'}}},
+            {'$sort': {'count': -1}},
+            {'$limit': 5}]
+
+    def test_group_by(self):
+        rows = User.query.filter(User.age > 10).group_by(User.role).agg(
+            count=func.count(), avg_age=func.avg(User.age)).sort(User.role).all()
+        assert rows == [{'role': 'admin', 'count': 2, 'avg_age': 17.5},
+                        {'role': 'user', 'count': 2, 'avg_age': 27.5}]
+
+        rows = User.query.group_by(User.role, User.team).agg(
+            oldest=func.max(User.age)).sort('oldest', -1).limit(2).all()
+        assert rows == [{'role': 'user', 'team': 'b', 'oldest': 30},
+                        {'role': 'user', 'team': 'a', 'oldest': 25}]
+
+    def test_totals(self):
+        rows = User.query.agg(total=func.sum(User.age), count=func.count()).all()
+        assert rows == [{'total': 100, 'count': 5}]
@@ -0,0 +1,131 @@
+import unittest
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from mongomodels import connections, MongoModel, String, Integer, Column, belongs_to, has_and_belongs_to
+from mongomodels.asynchronous import AsyncConnection, MemoryDriver
+from mongomodels.base import model_registery
+
+class Author(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class Book(MongoModel):
+    belongs_to(Author)
+    name = Column(String, required=True)
+
+class Label(MongoModel):
+    has_and_belongs_to(Book)
+    name = Column(String, required=True)
+
+class TestAsynchronous(unittest.TestCase):
+
+    def setUp(self):
+        self.db = AsyncConnection(MemoryDriver())
+
+    def run_sync(self, func):
+        return IOLoop.current().run_sync(func)
+
+    def test_crud(self):
+        db = self.db
+
+        @gen.coroutine
+        def crud():
+            for i in range(5):
+                yield db.save(Author(name='author %s' % i, age=i))
+
+            author = yield db.query(Author).filter(Author.age > 3).first()
+            assert author.name == 'author 4'
+            author.age = 10
+            yield db.save(author)
+
+            authors = yield db.query(Author).filter(Author.age > 3).sort('age', -1).all()
+            assert [a.age for a in authors] == [10]
+            assert (yield db.get_by_id(Author, author._id)).age == 10
+
+            cursor = db.query(Author).sort('age').cursor()
+            ages = []
+            while (yield cursor.fetch_next):
+                ages.append(cursor.next_object().age)
+            assert ages == [0, 1, 2, 3, 10]
+
+            assert (yield db.query(Author).filter(Author.age < 2).count()) == 2
+            yield db.delete(author)
+            assert (yield db.query(Author).count()) == 4
+            assert (yield db.query(Author).filter(Author.age < 2).delete()) == 2
+            assert (yield db.query(Author).count()) == 2
+
+        self.run_sync(crud)
+
+    def test_relationships(self):
+        db = self.db
+
+        @gen.coroutine
+        def relationships():
+            author = Author(name='foo', age=1)
+            yield db.save(author)
+            book = Book(name='book', author_id=author._id)
+            yield db.save(book)
+
+            books = yield db.related(author, 'books').all()
+            assert [b._id for b in books] == [book._id]
+            assert (yield db.related(book, 'author'))._id == author._id
+
+            label = Label(name='label')
+            yield db.save(label)
+            # the through class created by has_and_belongs_to
+            BookLabel = model_registery['BookLabel']
+            yield db.save(BookLabel(book_id=book._id, label_id=label._id))
+            labels = yield db.related(book, 'labels')
+            assert [l._id for l in labels] == [label._id]
+
+        self.run_sync(relationships)
+
+    def test_never_uses_sync_connection(self):
+        db = self.db
+        authors = [Author(name='author %s' % i, age=i) for i in range(3)]
+        book = Book(name='book')
+
+        def no_sync_connection(*args):
+            raise AssertionError('the synchronous connection was used')
+
+        @gen.coroutine
+        def queries():
+            for author in authors:
+                yield db.save(author)
+            book.author_id = authors[0]._id
+            yield db.save(book)
+
+            author = yield db.query(Author).filter(Author.age == 1).first()
+            assert author.name == 'author 1'
+            assert (yield db.query(Author).count()) == 3
+            assert len((yield db.query(Author).sort('age').all())) == 3
+            assert len((yield db.related(authors[0], 'books').all())) == 1
+            author.age = 5
+            yield db.save(author)
+            assert (yield db.query(Author).filter(Author.age == 5).delete()) == 1
+
+            for method in ('update', 'agg', 'values', 'scalars', 'as_dicts', 'yield_per',
+                           'stream', 'parallel_iter', 'explain', 'cached', 'paginate_after'):
+                with self.assertRaises(TypeError):
+                    getattr(db.query(Author), method)()
+            # loaded instances stay on the AsyncConnection
+            author.age = 6
+            with self.assertRaises(TypeError):
+                author.save()
+            with self.assertRaises(TypeError):
+                authors[0].books.all()
+
+        get, get_default = connections.get, connections.get_default
+        connections.get = connections.get_default = no_sync_connection
+        try:
+            self.run_sync(queries)
+        finally:
+            connections.get, connections.get_default = get, get_default
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column
+from mongomodels.cache import query_cache
+from mongomodels.column import canonicalize
+from bson.son import SON
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class TestQueryCache(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.users.remove()
+        query_cache.clear()
+
+    def test_cached(self):
+        u = User(name='foo', age=1)
+        u.save()
+
+        stats = query_cache.stats()
+        assert User.query.filter_by(name='foo').cached(ttl=30).one().age == 1
+        assert User.query.filter_by(name='foo').cached(ttl=30).one().age == 1
+        assert query_cache.stats()['hits'] == stats['hits'] + 1
+        assert query_cache.stats()['misses'] == stats['misses'] + 1
+
+        # writes from other processes are not seen
+        User.query.get_connection().update({'_id': u._id}, {'$set': {'age': 2}})
+        assert User.query.filter_by(name='foo').cached(ttl=30).one().age == 1
+        assert User.query.filter_by(name='foo').one().age == 2
+
+        # our own writes invalidate the collection
+        u.age = 3
+        u.save()
+        assert User.query.filter_by(name='foo').cached(ttl=30).first().age == 3
+        assert [x.age for x in User.query.cached(ttl=30)] == [3]
+
+        User.query.filter_by(name='foo').delete()
+        assert User.query.cached(ttl=30).first() is None
+
+    def test_invalidated_while_loading(self):
+        key = ('testdb.users', 'stale')
+
+        def load():
+            # another thread writes to the collection while the query runs
+            query_cache.invalidate('testdb.users')
+            return [{'age': 1}]
+
+        assert query_cache.get('testdb.users', key, 30, load) == [{'age': 1}]
+        assert key not in query_cache.entries
+        assert query_cache.get('testdb.users', key, 30, lambda: [{'age': 2}]) == [{'age': 2}]
+        assert key in query_cache.entries
+
+    def test_cache_keys(self):
+        # the order of conditions doesn't matter
+        assert canonicalize(SON([('name', 'foo'), ('age', SON([('$gt', 1), ('$lt', 5)]))])) == \
+            canonicalize(SON([('age', SON([('$lt', 5), ('$gt', 1)])), ('name', 'foo')]))
+        # embedded documents only match with the same key order
+        assert canonicalize({'address': SON([('city', 'x'), ('zip', '1')])}) != \
+            canonicalize({'address': SON([('zip', '1'), ('city', 'x')])})
+        assert canonicalize({'a': {'$in': [SON([('b', 1), ('c', 2)])]}}) != \
+            canonicalize({'a': {'$in': [SON([('c', 2), ('b', 1)])]}})
+
+    def test_connections_dont_share_results(self):
+        User(name='foo', age=1).save()
+        # another connection, on a server that happens to have a database with the same name
+        connections.add('analytics', pymongo.MongoClient().testdb)
+        stats = query_cache.stats()
+        assert User.query.cached(ttl=30).first().age == 1
+        assert User.query.using('analytics').cached(ttl=30).first().age == 1
+        assert User.query.read_preference('primary').cached(ttl=30).first().age == 1
+        assert query_cache.stats()['misses'] == stats['misses'] + 3
+        assert User.query.using('analytics').count(ttl=30) == 1
+        assert User.query.count(ttl=30) == 1
+        assert query_cache.stats()['misses'] == stats['misses'] + 5
+
+    def test_lru(self):
+        max_size = query_cache.max_size
+        query_cache.max_size = 2
+        try:
+            for age in range(3):
+                User.query.filter_by(age=age).cached().all()
+            assert query_cache.stats()['size'] == 2
+            assert query_cache.stats()['evictions'] >= 1
+        finally:
+            query_cache.max_size = max_size
+
+
+if __name__ == '__main__':
+    unittest.main()
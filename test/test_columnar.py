@@ -0,0 +1,72 @@
+import unittest
+import datetime
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from bson import ObjectId
+from mongomodels import connections, MongoModel, String, Integer, Column, Boolean, Date
+from mongomodels.column import Double
+
+class Player(MongoModel):
+    name = Column(String)
+    age = Column(Integer)
+    score = Column(Double)
+    active = Column(Boolean)
+    joined = Column(Date)
+
+@unittest.skipIf(numpy is None, 'to_columns needs numpy')
+class TestColumnar(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.players.remove()
+
+    def test_to_columns(self):
+        for i in range(5):
+            document = {'name': 'p%s' % i, 'age': i, 'score': i * 1.5, 'active': i % 2 == 0,
+                        'joined': datetime.datetime(2020, 1, i + 1)}
+            if i == 3:
+                del document['age']
+            Player.query.get_connection().insert(document)
+
+        columns = Player.query.sort('age').to_columns(Player._id, Player.age, Player.score,
+                                                      Player.active, Player.joined, Player.name)
+        assert list(columns) == ['_id', 'age', 'score', 'active', 'joined', 'name']
+        assert columns['age'].dtype == numpy.int64
+        assert columns['score'].dtype == numpy.float64
+        assert columns['active'].dtype == numpy.bool_
+        assert columns['joined'].dtype == numpy.dtype('datetime64[ms]')
+        assert columns['_id'].dtype == numpy.dtype('V12')
+        assert columns['name'].dtype == numpy.dtype(object)
+
+        # the missing age is masked, and sorted first
+        assert columns['age'].mask.tolist() == [True, False, False, False, False]
+        assert columns['age'].sum() == 0 + 1 + 2 + 4
+        assert columns['score'].sum() == 15.0
+        assert columns['joined'][1] == numpy.datetime64('2020-01-01')
+
+    def test_object_ids(self):
+        _id = ObjectId('5f0000000000000000000100')
+        Player.query.get_connection().insert({'_id': _id, 'age': 1})
+        columns = Player.query.to_columns(Player._id)
+        assert ObjectId(columns['_id'][0].tobytes()) == _id
+
+    def test_growing_buffers(self):
+        Player.insert_many([Player(name='p%s' % i, age=i) for i in range(50)])
+        columns = Player.query.to_columns(Player.age, size_hint=4)
+        assert len(columns['age']) == 50
+        assert sorted(columns['age'].tolist()) == range(50)
+
+    def test_wrong_type(self):
+        Player.query.get_connection().insert({'age': 'old'})
+        with self.assertRaises(ValueError):
+            Player.query.to_columns(Player.age)
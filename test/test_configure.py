@@ -0,0 +1,84 @@
+import unittest
+import threading
+import time
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import MongoModel, String, Column, belongs_to, \
+    ConfigurationError, configure_models
+from mongomodels.base import relationships_reg
+from mongomodels import column
+
+class Comment(MongoModel):
+    # forward reference, Post is defined below
+    belongs_to('post')
+    text = Column(String)
+
+class Post(MongoModel):
+    title = Column(String)
+
+class TestConfigure(unittest.TestCase):
+
+    def test_forward_reference(self):
+        configure_models()
+        assert not relationships_reg
+        assert 'post_id' in Comment.__columns__
+        assert Comment.post_id.name == 'post_id'
+
+    def test_unknown_model(self):
+        configure_models()
+
+        class Orphan(MongoModel):
+            belongs_to('nosuchmodel')
+
+        try:
+            with self.assertRaises(ConfigurationError):
+                configure_models()
+            # we don't silently retry on every instance either
+            with self.assertRaises(ConfigurationError):
+                Comment()
+        finally:
+            del relationships_reg[:]
+
+
+    def test_concurrent_configure(self):
+        configure_models()
+
+        class Reply(MongoModel):
+            belongs_to(Post)
+            text = Column(String)
+
+        configured = []
+        configure_relationship = column._configure_relationship
+
+        def slow_configure(rel):
+            # gives the other threads time to reach configure_models
+            time.sleep(0.05)
+            configured.append(rel)
+            configure_relationship(rel)
+
+        errors = []
+
+        def run():
+            try:
+                configure_models()
+            except Exception as e:
+                errors.append(e)
+
+        column._configure_relationship = slow_configure
+        try:
+            threads = [threading.Thread(target=run) for _ in range(4)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        finally:
+            column._configure_relationship = configure_relationship
+
+        assert not errors
+        assert len(configured) == 1
+        assert not relationships_reg
+        assert 'post_id' in Reply.__columns__
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column, Session
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class TestConnections(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        # a second database stands in for a secondary that didn't replicate yet
+        connections.add(client.testdb, readers=[client.testdb_reader])
+        connections.add('analytics', client.testdb_analytics)
+        # start fresh
+        client.testdb.users.remove()
+        client.testdb_reader.users.remove()
+        client.testdb_analytics.users.remove()
+        self.client = client
+
+    def tearDown(self):
+        connections.add(self.client.testdb)
+
+    def test_routing(self):
+        u = User(name='foo', age=1)
+        u.save()
+
+        # writes go to the writer, reads to the readers
+        assert self.client.testdb.users.count_documents({}) == 1
+        assert User.query.first() is None
+        assert User.query.count() == 0
+
+        assert User.query.read_preference('primary').first()._id == u._id
+        assert User.query.read_preference('secondaryPreferred').first() is None
+        with self.assertRaises(ValueError):
+            User.query.read_preference('somewhere').first()
+
+        assert User.query.using('analytics').count() == 0
+        self.client.testdb_analytics.users.insert({'name': 'bar'})
+        assert User.query.using('analytics').first().name == 'bar'
+
+    def test_read_your_writes(self):
+        session = Session(read_your_writes=True)
+        assert session.query(User).first() is None
+
+        session.add(User(name='foo', age=1))
+        session.flush()
+        assert session.query(User).first().name == 'foo'
+        assert Session().query(User).first() is None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+import unittest
+import os
+import shutil
+import tempfile
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from bson import BSON
+from mongomodels import connections, MongoModel, String, Integer, Column, ValidationError
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class TestDump(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        self.collection = client.testdb.users
+        # start fresh
+        self.collection.remove()
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_dump_and_load(self):
+        User.insert_many([User(name='user%s' % i, age=i) for i in range(25)])
+        # fields without a column survive the round trip
+        self.collection.update_one({'age': 0}, {'$set': {'extra': [1, 2]}})
+        documents = sorted(self.collection.find(), key=lambda d: d['age'])
+
+        for format in ('bson', 'jsonl'):
+            path = os.path.join(self.dir, 'users.%s' % format)
+            assert User.dump(path, format=format) == 25
+
+            self.collection.remove()
+            result = User.load(path, batch_size=10)
+            assert result.inserted == 25 and not result.errors
+            assert sorted(self.collection.find(), key=lambda d: d['age']) == documents
+
+    def test_dump_query(self):
+        User.insert_many([User(name='user%s' % i, age=i) for i in range(10)])
+        path = os.path.join(self.dir, 'old.jsonl')
+        query = User.query.filter(User.age >= 7)
+        assert User.dump(path, query=query, format='jsonl') == 3
+        assert query.batch_size_ is None
+        assert len(open(path).readlines()) == 3
+
+    def test_format_from_extension(self):
+        User.insert_many([User(name='user%s' % i, age=i) for i in range(5)])
+        path = os.path.join(self.dir, 'users.jsonl')
+        assert User.dump(path) == 5
+        assert open(path).readline().startswith('{')
+
+        self.collection.remove()
+        result = User.load(path)
+        assert result.inserted == 5 and not result.errors
+        assert sorted(d['age'] for d in self.collection.find()) == range(5)
+
+    def test_load_errors(self):
+        path = os.path.join(self.dir, 'users.bson')
+        with open(path, 'wb') as f:
+            f.write(BSON.encode({'name': 'foo', 'age': 1}))
+            f.write(BSON.encode({'age': 2}))
+            f.write(BSON.encode({'name': 'bar', 'age': 3}))
+
+        result = User.load(path)
+        assert result.inserted == 2
+        assert len(result.errors) == 1 and isinstance(result.errors[0][1], ValidationError)
+
+        self.collection.remove()
+        result = User.load(path, ordered=True)
+        assert result.inserted == 1 and len(result.errors) == 1
+
+        with open(path, 'ab') as f:
+            f.write('\x10\x00\x00')
+        with self.assertRaises(ValueError):
+            User.load(path, validate=False)
@@ -0,0 +1,85 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column
+from mongomodels import events
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class TestEvents(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.users.remove()
+        self.received = []
+        self.listeners = [('before_execute', lambda e: self.received.append(('before', e))),
+                          ('after_execute', lambda e: self.received.append(('after', e))),
+                          ('on_hydrate', lambda e, i: self.received.append(('hydrate', i)))]
+        for name, fn in self.listeners:
+            events.listen(name, fn)
+
+    def tearDown(self):
+        for name, fn in self.listeners:
+            events.remove(name, fn)
+
+    def test_query_events(self):
+        for i in range(3):
+            User(name='foo', age=i).save()
+        del self.received[:]
+
+        users = User.query.filter(User.age > 0).sort('age').limit(10).all()
+        assert [kind for kind, _ in self.received] == ['before', 'hydrate', 'hydrate', 'after']
+        event = self.received[-1][1]
+        assert event.model is User
+        assert event.operation == 'find'
+        assert event.criteria == {'age': {'$gt': 0}}
+        assert event.limit == 10
+        assert event.documents == 2
+        assert event.elapsed >= 0 and event.hydration_time >= 0
+        assert self.received[1][1] is users[0]
+        assert event.get_shape() == "User find {age: {$gt: ?}} sort:['age']"
+
+        del self.received[:]
+        User.query.filter_by(name='foo').first()
+        assert [kind for kind, _ in self.received] == ['before', 'hydrate', 'after']
+
+    def test_write_events(self):
+        u = User(name='foo', age=1)
+        u.save()
+        u.age = 2
+        u.save()
+        u.delete()
+        assert [(kind, e.operation) for kind, e in self.received if kind == 'after'] == \
+            [('after', 'insert'), ('after', 'update'), ('after', 'delete')]
+
+    def test_stats_and_slow_log(self):
+        stats = events.listen('after_execute', events.QueryStats())
+        messages = []
+
+        class Logger(object):
+            def log(self, level, msg, *args):
+                messages.append(msg % args)
+
+        slow = events.listen('after_execute', events.SlowQueryLogger(threshold=0, logger=Logger()))
+        try:
+            User(name='foo', age=1).save()
+            for age in range(5):
+                User.query.filter(User.age == age).all()
+        finally:
+            events.remove('after_execute', stats)
+            events.remove('after_execute', slow)
+
+        shapes = dict((s['shape'], s) for s in stats.snapshot())
+        find = shapes['User find {age: ?} sort:None']
+        assert find['count'] == 5
+        assert find['documents'] == 1
+        assert find['p50'] <= find['p99']
+        assert shapes['User insert None sort:None']['count'] == 1
+        assert len(messages) == 6 and messages[-1].startswith('slow query')
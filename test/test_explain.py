@@ -0,0 +1,97 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column
+from mongomodels import events
+from mongomodels.explain import Explain, PlanChecker, QueryPlanError
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+COLLSCAN = {'queryPlanner': {'winningPlan': {'stage': 'COLLSCAN', 'filter': {'age': {'$eq': 1}}}},
+            'executionStats': {'nReturned': 1, 'executionTimeMillis': 3,
+                               'totalKeysExamined': 0, 'totalDocsExamined': 500}}
+
+IXSCAN = {'queryPlanner': {'winningPlan': {'stage': 'FETCH',
+                                           'inputStage': {'stage': 'IXSCAN', 'keyPattern': {'age': 1}}}},
+          'executionStats': {'nReturned': 1, 'executionTimeMillis': 0,
+                             'totalKeysExamined': 1, 'totalDocsExamined': 1}}
+
+class ExplainedCursor(object):
+    """stands in for a pymongo cursor, returns a canned plan"""
+    def __init__(self, plan):
+        self.plan = plan
+
+    def explain(self):
+        return self.plan
+
+class TestExplain(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.users.remove()
+
+    def test_explain(self):
+        explain = Explain(COLLSCAN)
+        assert explain.is_collscan
+        assert explain.docs_examined == 500 and explain.returned == 1
+        assert explain.time == 0.003
+        assert explain.get_ratio() == 500
+
+        explain = Explain(IXSCAN)
+        assert explain.stages == ['FETCH', 'IXSCAN']
+        assert not explain.is_collscan
+
+    def test_query_explain(self):
+        User(name='foo', age=1).save()
+        query = User.query.filter_by(name='foo')
+        if not hasattr(query.get_cursor(), 'explain'):
+            self.skipTest('needs a mongod')
+        explain = query.explain()
+        assert explain.returned == 1
+        assert explain.stages
+
+    def test_plan_checker(self):
+        checker = PlanChecker(max_ratio=10, action='raise')
+
+        event = events.ExecuteEvent(User, 'find', criteria={'age': 1}, cursor=ExplainedCursor(IXSCAN))
+        checker(event)
+
+        event = events.ExecuteEvent(User, 'find', criteria={'age': 2}, cursor=ExplainedCursor(COLLSCAN))
+        # same shape, explained only once
+        checker(event)
+
+        event = events.ExecuteEvent(User, 'find', criteria={'name': 'foo'}, cursor=ExplainedCursor(COLLSCAN))
+        with self.assertRaises(QueryPlanError):
+            checker(event)
+
+        # scanning everything is fine when we ask for everything
+        everything = dict(COLLSCAN, executionStats=dict(COLLSCAN['executionStats'], nReturned=500))
+        event = events.ExecuteEvent(User, 'find', criteria={}, cursor=ExplainedCursor(everything))
+        checker(event)
+
+        many = dict(IXSCAN, executionStats=dict(IXSCAN['executionStats'], totalDocsExamined=50))
+        event = events.ExecuteEvent(User, 'find', criteria={'age': {'$gt': 1}}, cursor=ExplainedCursor(many))
+        with self.assertRaises(QueryPlanError):
+            checker(event)
+
+    def test_plan_checker_listener(self):
+        User(name='foo', age=1).save()
+        plans = []
+
+        class Checker(PlanChecker):
+            def __call__(self, event):
+                plans.append(event.cursor)
+
+        checker = events.listen('before_execute', Checker())
+        try:
+            User.query.filter_by(name='foo').all()
+        finally:
+            events.remove('before_execute', checker)
+        assert len(plans) == 1
@@ -0,0 +1,59 @@
+import unittest
+import pymongo
+from pymongo import IndexModel
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column, Date, \
+    belongs_to, has_and_belongs_to, sync_indexes, ConfigurationError
+
+class Account(MongoModel):
+    email = Column(String, unique=True, sparse=True)
+    name = Column(String, index=True)
+    age = Column(Integer, index=pymongo.DESCENDING)
+    created_at = Column(Date)
+
+    __indexes__ = [[('name', 1), ('age', -1)],
+                   IndexModel('created_at', expireAfterSeconds=3600)]
+
+class Invoice(MongoModel):
+    belongs_to(Account)
+    total = Column(Integer)
+
+class Tag(MongoModel):
+    has_and_belongs_to(Invoice)
+    name = Column(String)
+
+class TestIndexes(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        self.db = client.testdb
+        # start fresh
+        for collection in self.db.collection_names():
+            self.db[collection].drop()
+
+    def test_sync_indexes(self):
+        created = Account.sync_indexes()
+        assert sorted(created) == ['age_-1', 'created_at_1', 'email_1', 'name_1', 'name_1_age_-1']
+
+        info = self.db.accounts.index_information()
+        assert info['email_1']['unique'] and info['email_1']['sparse']
+        assert info['created_at_1']['expireAfterSeconds'] == 3600
+
+        # nothing is missing the second time
+        assert Account.sync_indexes() == []
+
+    def test_sparse_without_index(self):
+        with self.assertRaises(ConfigurationError):
+            Column(String, sparse=True)
+
+    def test_relationship_indexes(self):
+        created = sync_indexes()
+        assert created['invoices'] == ['account_id_1']
+        # the generated through collection
+        assert ['invoice_id_1', 'tag_id_1', 'tag_id_1_invoice_id_1'] in \
+            [sorted(names) for names in created.values()]
+        assert 'invoices' not in sync_indexes()
@@ -0,0 +1,75 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, \
+    Column, ValidationError
+
+class User(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class TestInsertMany(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.users.remove()
+
+    def test_insert_many(self):
+        users = [User(name='user %s' % i, age=i) for i in range(25)]
+        result = User.insert_many(users, batch_size=10)
+        assert len(result.inserted) == 25
+        assert not result.errors
+        assert User.query.count() == 25
+        for u in users:
+            assert u._id
+            assert User.query.filter_by(_id=u._id).one().name == u.name
+
+    def test_insert_many_reports_failures(self):
+        existing = User(name='existing', age=1)
+        existing.save()
+
+        duplicate = User(name='duplicate', age=2)
+        duplicate._id = existing._id
+        invalid = User(age=3)
+        users = [User(name='first', age=4), invalid, duplicate, User(name='last', age=5)]
+
+        result = User.insert_many(users)
+        assert len(result.inserted) == 2
+        assert len(result.errors) == 2
+        self.assertIs(result.errors[0][0], invalid)
+        self.assertIsInstance(result.errors[0][1], ValidationError)
+        self.assertIs(result.errors[1][0], duplicate)
+        assert User.query.count() == 3
+
+    def test_insert_many_ordered(self):
+        users = [User(name='first', age=1), User(age=2), User(name='last', age=3)]
+        result = User.insert_many(users, ordered=True)
+        assert len(result.inserted) == 1
+        assert len(result.errors) == 1
+        assert users[2]._id is None
+        assert result.not_inserted == [users[2]]
+        assert User.query.count() == 1
+
+    def test_insert_many_ordered_write_error(self):
+        existing = User(name='existing', age=1)
+        existing.save()
+        duplicate = User(name='duplicate', age=2)
+        duplicate._id = existing._id
+        users = [User(name='first', age=3), duplicate, User(name='second', age=4),
+                 User(name='third', age=5), User(name='fourth', age=6)]
+
+        result = User.insert_many(users, ordered=True, batch_size=3)
+        assert result.inserted == users[:1]
+        self.assertIs(result.errors[0][0], duplicate)
+        # the rest of the batch and the batches after it are never sent
+        assert result.not_inserted == users[2:]
+        assert User.query.count() == 2
+
+
+if __name__ == '__main__':
+    unittest.main()
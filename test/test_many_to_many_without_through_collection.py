@@ -4,7 +4,7 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 from mongomodels import connections, MongoModel, String, Integer, \
-    Column, or_, ValidationError, Boolean, belongs_to, has_and_belongs_to
+    Column, or_, ValidationError, Boolean, belongs_to, has_and_belongs_to, Session
 
 
 # a category has many products and a product belongs to more than one category
@@ -45,6 +45,28 @@ class TestManyToMany(unittest.TestCase):
         c.products.remove(p)
         assert len(list(c.products)) == 0
 
+    def test_many_to_many_add_twice(self):
+        c = Category(name='cat')
+        p = Product(name='product')
+        c.products.add(p)
+        c.products.add(p)
+        assert c.products.count() == 1
+        assert len(list(c.products)) == 1
+
+    def test_many_to_many_session(self):
+        c = Category(name='cat')
+        c.save()
+        with Session() as session:
+            session.add(c)
+            p = Product(name='product')
+            c.products.add(p)
+            c.products.add(p)
+            # the product and the link are written on flush
+            assert Product.query.count() == 0
+            assert c.products.through.query.count() == 0
+        assert c.products.count() == 1
+        assert c.products.first()._id == p._id
+
     def test_many_to_many_add_reverse(self):
         c = Category(name='cat')
         c.save()
@@ -64,6 +86,74 @@ class TestManyToMany(unittest.TestCase):
         p.categories.remove(c)
         assert len(list(p.categories)) == 0
 
+    def test_many_to_many_batches(self):
+        c = Category(name='cat')
+        c.save()
+
+        products = [Product(name='product %s' % (i % 3)) for i in range(250)]
+        for p in products:
+            c.products.add(p)
+
+        assert [p._id for p in c.products] == [p._id for p in products]
+        assert c.products.count() == 250
+
+        filtered = c.products.filter_by(name='product 1').all()
+        assert [p._id for p in filtered] == [p._id for p in products if p.name == 'product 1']
+        assert c.products.filter_by(name='product 1').count() == len(filtered)
+
+        lookup = c.products.lookup().filter_by(name='product 1').all()
+        assert [p._id for p in lookup] == [p._id for p in filtered]
+        assert c.products.lookup().first()._id == products[0]._id
+
+
+    def test_many_to_many_update(self):
+        c = Category(name='cat')
+        linked = Product(name='in')
+        c.products.add(linked)
+        unlinked = Product(name='out')
+        unlinked.save()
+
+        result = c.products.update({Product.name: 'changed'})
+        assert result.modified_count == 1
+        assert Product.query.filter_by(_id=linked._id).one().name == 'changed'
+        assert Product.query.filter_by(_id=unlinked._id).one().name == 'out'
+
+    def test_many_to_many_stream(self):
+        c = Category(name='cat')
+        products = [Product(name='in %s' % i) for i in range(5)]
+        for p in products:
+            c.products.add(p)
+        Product(name='out').save()
+
+        assert [p.name for p in c.products.stream(batch_size=2)] == [p.name for p in products]
+        assert [len(b) for b in c.products.yield_per(2)] == [2, 2, 1]
+
+    def test_many_to_many_values(self):
+        c = Category(name='cat')
+        products = [Product(name='in %s' % i) for i in range(3)]
+        for p in products:
+            c.products.add(p)
+        Product(name='out').save()
+
+        assert list(c.products.values(Product.name)) == [('in 0',), ('in 1',), ('in 2',)]
+        assert list(c.products.scalars(Product._id)) == [p._id for p in products]
+        assert list(c.products.as_dicts(Product.name)) == [{'name': 'in 0'}, {'name': 'in 1'}, {'name': 'in 2'}]
+        assert list(c.products.filter_by(name='in 1').scalars(Product.name)) == ['in 1']
+        assert list(c.products.offset(1).limit(1).scalars(Product.name)) == ['in 1']
+
+    def test_many_to_many_count(self):
+        c = Category(name='cat')
+        for i in range(5):
+            c.products.add(Product(name='in %s' % (i % 2)))
+        Product(name='in 0').save()
+
+        assert c.products.count(limit=3) == 3
+        assert c.products.filter_by(name='in 0').count() == 3
+        assert c.products.filter_by(name='in 0').count(limit=2) == 2
+        assert c.products.count(ttl=30) == 5
+        # adding a link drops the remembered count
+        c.products.add(Product(name='new'))
+        assert c.products.count(ttl=30) == 6
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
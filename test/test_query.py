@@ -4,7 +4,7 @@ import logging
 logging.basicConfig(level=logging.DEBUG)
 
 from mongomodels import connections, MongoModel, String, Integer, \
-    Column, or_, ValidationError, Boolean, belongs_to
+    Column, or_, ValidationError, Boolean, belongs_to, eager, bindparam
 
 class User(MongoModel):
     name =  Column(String, required=True)
@@ -50,6 +50,202 @@ class TestColumns(unittest.TestCase):
         p.notes.add(note)
         assert u.projects.first().notes.first()._id == note._id
 
+    def test_eager_load(self):
+        users = []
+        for i in range(3):
+            u = User(name='user %s' % i, age=i)
+            u.save()
+            users.append(u)
+            for j in range(2):
+                u.projects.add(Project(name='project %s %s' % (i, j)))
+        orphan = Project(name='orphan')
+        orphan.save()
+
+        projects = Project.query.options(eager('user')).all()
+        assert len(projects) == 7
+
+        # parents are already loaded, the database isn't hit again
+        User.query.delete()
+        for p in projects:
+            if p._id == orphan._id:
+                assert p.user is None
+            else:
+                assert p.user.name == [u for u in users if u._id == p.user_id][0].name
+
+        # reassigning the foreign key invalidates the cached parent
+        project = projects[0]
+        project.user_id = orphan._id
+        assert project.user is None
+
+    def test_only_and_defer(self):
+        u = User(name='foo', age=15, role='user')
+        u.save()
+
+        dbuser = User.query.filter_by(_id=u._id).only(User.name).one()
+        assert 'age' not in dbuser.__dict__
+        assert 'role' not in dbuser.__dict__
+
+        # unloaded columns are not overwritten
+        dbuser.name = 'bar'
+        dbuser.save()
+        doc = User.query.get_connection().find_one({'_id': u._id})
+        assert doc == {'_id': u._id, 'name': 'bar', 'age': 15, 'role': 'user'}
+
+        # the first access loads all deferred columns
+        assert dbuser.age == 15
+        assert dbuser.__dict__['role'] == 'user'
+
+        dbuser = User.query.filter_by(_id=u._id).defer(User.age).one()
+        assert dbuser.name == 'bar'
+        assert 'age' not in dbuser.__dict__
+        dbuser.age = 16
+        dbuser.save()
+        assert User.query.filter_by(_id=u._id).one().age == 16
+
+    def test_yield_per(self):
+        User.insert_many([User(name='user %s' % i, age=i) for i in range(25)])
+
+        batches = list(User.query.sort('age').yield_per(10))
+        assert [len(b) for b in batches] == [10, 10, 5]
+        assert [u.age for b in batches for u in b] == range(25)
+
+        assert [u.age for u in User.query.sort('age').stream(batch_size=7)] == range(25)
+        query = User.query
+        list(query.yield_per(10))
+        assert query.batch_size_ is None
+        assert len(User.query.batch_size(5).no_cursor_timeout().all()) == 25
+
+    def test_paginate_after(self):
+        User.insert_many([User(name='user %s' % i, age=i % 7) for i in range(25)])
+
+        orders = [
+            (lambda: User.query, lambda u: u._id, False),
+            (lambda: User.query.sort('age'), lambda u: (u.age, u._id), False),
+            (lambda: User.query.sort('age', -1), lambda u: (u.age, u._id), True),
+        ]
+        for query, key, reverse in orders:
+            seen = []
+            pages = []
+            token = None
+            while True:
+                page = query().paginate_after(token, 10)
+                pages.append(len(page))
+                seen.extend(page)
+                if not page.has_next:
+                    break
+                token = page.next_token
+
+            assert pages == [10, 10, 5]
+            assert len(set(u._id for u in seen)) == 25
+            assert [u._id for u in seen] == [u._id for u in sorted(seen, key=key, reverse=reverse)]
+
+        page = User.query.filter(User.age > 4).sort(User.age).paginate_after(None, 3)
+        assert [u.age for u in page] == [5, 5, 5]
+        with self.assertRaises(ValueError):
+            User.query.paginate_after(page.next_token, 3)
+        page = User.query.filter(User.age > 4).sort(User.age).paginate_after(page.next_token, 3)
+        assert [u.age for u in page] == [6, 6, 6]
+        assert not page.has_next
+
+        assert [u.age for u in User.query.sort('age').offset(20).limit(3)] == [5, 5, 6]
+
+    def test_count(self):
+        User.insert_many([User(name='user %s' % i, age=i) for i in range(25)])
+
+        assert User.query.count() == 25
+        assert User.query.filter(User.age < 10).count() == 10
+        assert User.query.filter(User.age < 10).count(limit=5) == 5
+        assert User.estimated_count() == 25
+
+        assert User.query.filter(User.age < 10).count(ttl=60) == 10
+        # writes from other processes are not seen until the count expires
+        User.query.get_connection().delete_one({'age': 1})
+        assert User.query.filter(User.age < 10).count(ttl=60) == 10
+        assert User.query.filter(User.age < 10).count() == 9
+        # our own writes drop the remembered count
+        User.query.filter(User.age == 2).delete()
+        assert User.query.filter(User.age < 10).count(ttl=60) == 8
+
+    def test_compiled_query(self):
+        User.insert_many([User(name='user %s' % i, age=i, role='user') for i in range(10)])
+
+        by_age = User.query.filter(User.age > bindparam('min_age'))\
+            .filter_by(role='user').filter(User.age.in_(bindparam('ages'))).compile()
+        assert by_age.criteria == {'age': {'$gt': by_age.criteria['age']['$gt']},
+                                   'role': 'user',
+                                   '$and': [{'age': {'$in': by_age.criteria['$and'][0]['age']['$in']}}]}
+
+        assert by_age.get_criteria(min_age=3, ages=[1, 4, 5]) == \
+            {'age': {'$gt': 3}, 'role': 'user', '$and': [{'age': {'$in': [1, 4, 5]}}]}
+        assert sorted(u.age for u in by_age.all(min_age=3, ages=[1, 4, 5])) == [4, 5]
+        assert by_age.count(min_age=4, ages=[1, 4, 5]) == 1
+        assert by_age.execute(min_age=0, ages=range(10)).sort('age').limit(2).all()[1].age == 2
+
+        with self.assertRaises(ValueError):
+            by_age.all(min_age=3)
+
+        # options of an execution don't change the compiled query
+        deferred = User.query.filter(User.age > bindparam('min_age')).defer(User.role).compile()
+        user = deferred.execute(min_age=8).defer(User.name).sort('age').first()
+        assert user.__dict__.get('name') is None and user.name == 'user 9'
+        assert deferred.query.projection_ == {'role': False}
+
+        static = User.query.filter_by(role='user').filter(User.age < 2).compile()
+        assert static.criteria == {'role': 'user', 'age': {'$lt': 2}}
+        assert len(static.all()) == 2
+
+    def test_parallel_iter(self):
+        User.insert_many([User(name='user %s' % i, age=i) for i in range(250)])
+
+        users = list(User.query.parallel_iter(workers=4, batch_size=10))
+        assert sorted(u.age for u in users) == range(250)
+
+        users = list(User.query.filter(User.age >= 100).parallel_iter(workers=4, ordered=True, batch_size=10))
+        assert [u.age for u in users] == range(100, 250)
+
+        users = list(User.query.parallel_iter(workers=3, key=User.age, ordered=True, partitions=7))
+        assert [u.age for u in users] == range(250)
+
+        assert sum(User.query.parallel_map(lambda u: u.age, workers=4)) == sum(range(250))
+
+        # documents without the key are left out of a scan on it
+        User.query.get_connection().insert_many([{'name': 'no age'}, {'name': 'null age', 'age': None}])
+        users = list(User.query.parallel_iter(workers=3, key=User.age, ordered=True))
+        assert [u.age for u in users] == range(250)
+
+    def test_values(self):
+        for i in range(3):
+            User(name='user%s' % i, age=i).save()
+
+        rows = list(User.query.filter(User.age > 0).sort('age').values(User.name, 'age'))
+        assert rows == [('user1', 1), ('user2', 2)]
+        ids = list(User.query.sort('age').scalars(User._id))
+        assert ids == [u._id for u in User.query.sort('age')]
+        assert list(User.query.sort('age').as_dicts(User.age)) == [{'age': 0}, {'age': 1}, {'age': 2}]
+        assert set(next(User.query.as_dicts())) >= set(['_id', 'name', 'age'])
+
+        # the query still loads whole instances afterwards
+        query = User.query.sort('age')
+        assert list(query.values(User.name)) == [('user0',), ('user1',), ('user2',)]
+        assert list(query.scalars(User.age)) == [0, 1, 2]
+        user = query.all()[0]
+        assert user.age == 0 and not user.__dict__.get('__deferred__')
+
+    def test_first_and_one(self):
+        for i in range(3):
+            User(name='user%s' % i, age=i).save()
+
+        query = User.query.sort('age')
+        assert query.first().age == 0
+        # first() doesn't limit the query it's called on
+        assert len(query.all()) == 3
+
+        with self.assertRaises(AssertionError):
+            User.query.filter(User.age > 0).one()
+        with self.assertRaises(AssertionError):
+            User.query.filter(User.age > 5).one()
+        assert User.query.filter(User.age > 1).one().age == 2
+
     def test_basic_crud(self):
         u = User()
         u.age = 15
@@ -114,6 +310,43 @@ class TestColumns(unittest.TestCase):
         dbusers = User.query.filter(User.age == 25).filter({'name': {'$regex': '^fo'}}).all()
         assert len(dbusers) == 1
 
+    def test_update_sends_only_dirty_columns(self):
+        u = User(name='foo', age=15, role='user')
+        u.save()
+        assert not u.get_dirty_columns()
+
+        dbuser = User.query.filter_by(_id=u._id).one()
+        assert not dbuser.get_dirty_columns()
+
+        # someone else changes the name in the meantime
+        User.query.get_connection().update({'_id': u._id}, {'$set': {'name': 'bar'}})
+
+        u.age = 16
+        u.role = None
+        assert u.get_dirty_columns() == set(['age', 'role'])
+        u.save()
+        assert not u.get_dirty_columns()
+
+        doc = User.query.get_connection().find_one({'_id': u._id})
+        assert doc['name'] == 'bar'
+        assert doc['age'] == 16
+        assert 'role' not in doc
+
+        # nothing changed, nothing is sent
+        User.query.get_connection().update({'_id': u._id}, {'$set': {'age': 17}})
+        u.save()
+        assert User.query.filter_by(_id=u._id).one().age == 17
+
+    def test_hydration(self):
+        User.query.get_connection().insert({'name': 'foo', 'extra': 1})
+        dbuser = User.query.filter_by(name='foo').first()
+        self.assertIsInstance(dbuser, User)
+        assert dbuser.name == 'foo'
+        assert dbuser.age is None
+        assert dbuser.extra == 1
+        assert dbuser.__connection__ is connections.get_default()
+        assert not dbuser.get_dirty_columns()
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
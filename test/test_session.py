@@ -0,0 +1,97 @@
+import unittest
+import pymongo
+from bson import ObjectId
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, \
+    Column, belongs_to, Session, ValidationError
+
+class Member(MongoModel):
+    name = Column(String, required=True)
+    age = Column(Integer)
+
+class Task(MongoModel):
+    belongs_to(Member)
+    name = Column(String, required=True)
+
+class TestSession(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.members.remove()
+        client.testdb.tasks.remove()
+
+    def test_identity_map(self):
+        u = Member(name='foo', age=1)
+        u.save()
+
+        session = Session()
+        u1 = session.get_by_id(Member, u._id)
+        u2 = session.get_by_id(Member, str(u._id))
+        u3 = session.query(Member).filter_by(name='foo').first()
+        assert u1 is u2 is u3
+        assert u1 is not u
+
+    def test_flush(self):
+        session = connections.get_default().session()
+        u = session.add(Member(name='foo', age=1))
+        assert u._id
+        u.tasks.add(Task(name='task'))
+
+        # nothing is written before the flush
+        assert Member.query.count() == 0
+        assert Task.query.count() == 0
+
+        session.flush()
+        assert Member.query.count() == 1
+        assert Task.query.filter_by(member_id=u._id).one().name == 'task'
+
+        u.age = 2
+        u.save()
+        other = Member(name='bar', age=3)
+        other.save()
+        session.add(other)
+        session.delete(other)
+        assert Member.query.filter_by(_id=u._id).one().age == 1
+
+        session.commit()
+        assert Member.query.filter_by(_id=u._id).one().age == 2
+        assert Member.query.count() == 1
+
+    def test_flush_assigned_id(self):
+        session = Session()
+        _id = ObjectId()
+        session.add(Member(_id=_id, name='foo', age=1))
+        session.flush()
+        assert Member.query.filter_by(_id=_id).one().name == 'foo'
+
+    def test_flush_validates(self):
+        session = Session()
+        session.add(Member(name='foo', age=1))
+        session.add(Member(age='notint'))
+        with self.assertRaises(ValidationError):
+            session.flush()
+        assert Member.query.count() == 0
+
+    def test_context_manager(self):
+        with Session() as session:
+            u = Member(name='foo', age=1)
+            session.add(u)
+        assert Member.query.filter_by(_id=u._id).one().name == 'foo'
+        assert u.get_session() is None
+
+        try:
+            with Session() as session:
+                session.add(Member(name='bar', age=1))
+                raise ValueError()
+        except ValueError:
+            pass
+        assert Member.query.count() == 1
+
+
+if __name__ == '__main__':
+    unittest.main()
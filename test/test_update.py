@@ -0,0 +1,105 @@
+import unittest
+import pymongo
+import logging
+logging.basicConfig(level=logging.DEBUG)
+
+from mongomodels import connections, MongoModel, String, Integer, Column, ValidationError
+from mongomodels.column import Array, compile_update
+
+class Article(MongoModel):
+    title = Column(String, required=True)
+    views = Column(Integer)
+    tags = Column(Array)
+    status = Column(String)
+
+class TestUpdate(unittest.TestCase):
+
+    def setUp(self):
+        #
+        client = pymongo.MongoClient()
+        connections.add(client.testdb)
+        # start fresh
+        client.testdb.articles.remove()
+
+    def test_compile_update(self):
+        assert compile_update([Article.views.inc(2), {Article.title: 'foo', 'status': None}],
+                              {'tags': []}) == \
+            {'$inc': {'views': 2}, '$set': {'title': 'foo', 'tags': []}, '$unset': {'status': ''}}
+        assert Article.tags.push('a', 'b').as_mongo_expression() == {'$push': {'tags': {'$each': ['a', 'b']}}}
+        assert Article.tags.pull('a').as_mongo_expression() == {'$pull': {'tags': 'a'}}
+        with self.assertRaises(ValueError):
+            compile_update([])
+
+    def test_query_update(self):
+        for i in range(4):
+            Article(title='t%s' % i, views=i, tags=[]).save()
+
+        result = Article.query.filter(Article.views >= 2).update(
+            Article.views.inc(10), Article.tags.push('popular'), status='hot')
+        assert result.modified_count == 2
+        assert sorted(a.views for a in Article.query.all()) == [0, 1, 12, 13]
+        assert Article.query.filter_by(status='hot').count() == 2
+        assert Article.query.filter_by(title='t3').one().tags == ['popular']
+
+        Article.query.update({Article.status: None})
+        assert Article.query.filter_by(status='hot').count() == 0
+
+    def test_instance_updates(self):
+        a = Article(title='foo', views=1, tags=['a', 'b'])
+        a.save()
+
+        # someone else increments in the meantime, nothing is lost
+        Article.query.filter_by(title='foo').update(Article.views.inc(5))
+        a.inc(Article.views, 1)
+        assert a.views == 7
+        assert not a.get_dirty_columns()
+
+        a.push('tags', 'c').pull(Article.tags, 'a')
+        assert a.tags == ['b', 'c']
+        assert Article.get_by_id(a._id).tags == ['b', 'c']
+
+    def test_upsert(self):
+        a = Article.upsert({Article.title: 'foo'}, {Article.views: Article.views.inc(1),
+                                                    'status': Article.status.set_on_insert('new')})
+        assert a.title == 'foo' and a.views == 1 and a.status == 'new' and a._id
+
+        b = Article.upsert({'title': 'foo'}, [Article.views.inc(1), Article.status.set_on_insert('old')])
+        assert b._id == a._id and b.views == 2 and b.status == 'new'
+        assert Article.query.count() == 1
+
+        with self.assertRaises(ValidationError):
+            Article.upsert({'title': 'foo'}, {'views': 'many'})
+        # an insert would leave the required title out
+        with self.assertRaises(ValidationError):
+            Article.upsert({'views': {'$gt': 5}}, {'status': 'popular'})
+        with self.assertRaises(ValidationError):
+            Article.get_or_create(title={'$in': ['foo', 'bar']}, views=1)
+        # nothing to insert
+        with self.assertRaises(ValueError):
+            Article.upsert({'views': {'$gt': 5}})
+        assert Article.query.count() == 1
+
+    def test_get_or_create(self):
+        a = Article.get_or_create(title='foo', defaults={'views': 10})
+        assert a.views == 10
+        b = Article.get_or_create(title='foo', defaults={'views': 20})
+        assert b._id == a._id and b.views == 10
+        c = Article.get_or_create(title='bar')
+        assert c.title == 'bar' and c._id != a._id
+        assert Article.query.count() == 2
+
+    def test_in_place_changes(self):
+        a = Article(title='foo', views=0, tags=['a'])
+        a.save()
+        a.tags.append('b')
+        a.save()
+        assert Article.query.get_connection().find_one({'_id': a._id})['tags'] == ['a', 'b']
+
+        loaded = Article.query.filter_by(_id=a._id).one()
+        assert loaded.tags == ['a', 'b']
+        assert not loaded.get_dirty_columns()
+        loaded.tags.remove('a')
+        assert loaded.get_dirty_columns() == set(['tags'])
+        loaded.save()
+        assert not loaded.get_dirty_columns()
+        assert Article.query.get_connection().find_one({'_id': a._id})['tags'] == ['b']